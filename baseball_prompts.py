@@ -312,56 +312,6 @@ def getTemplatePrompt(finalqu, statement):
 
 
 
-def getFullSQLPrompt(finalqu, template, metadata):
-    
-    prompt = f"""
-    You are a mechanical placeholder replacer. Your ONLY task is to replace placeholders in the SQL template with values from metadata — NOTHING ELSE.
-    
-    TemplateSQL: {template}
-    Metadata: {metadata}
-    
-    Rules:
-    1. ONLY replace placeholders that EXPLICITLY appear in the TemplateSQL.
-    2. DO NOT add ANY new WHERE conditions, JOINs, or filters — even if metadata has extra keys.
-    3. Replace:
-       - ##playerid## → with numeric value from metadata (key may be player name or 'player')
-       - ##teamid## → with numeric value from metadata (key may be team name or 'team')
-       - ##rivalteamid## → with numeric value from metadata (key may be rival team name or 'rivalteam')
-       - ##venueid## → with numeric value from metadata (key may be venue name or 'venue')
-    4. If a placeholder appears but its value is missing or None in metadata, REMOVE THE ENTIRE CONDITION containing that placeholder.
-       - Example: "WHERE a = 1 AND b = ##xyz##" → if ##xyz## is None → "WHERE a = 1"
-       - If it's the only condition: "WHERE x = ##playerid##" → becomes no WHERE clause.
-    5. Output format: <SQL>SELECT ...</SQL>
-    6. NO explanations. NO extra text. NO markdown. ONLY the <SQL> block.
-    
-    Example 1:
-    TemplateSQL: SELECT player_name, homeRuns FROM player_performance WHERE team_id = ##teamid## AND season = 2025
-    Metadata: {{"Astros": 123}}
-    FullSQL: <SQL>SELECT player_name, homeRuns FROM player_performance WHERE team_id = 123 AND season = 2025</SQL>
-
-    Example 2:
-    TemplateSQL: SELECT * FROM player_performance WHERE player_id = ##playerid##
-    Metadata: {{'Mike Trout': 204}}
-    Output: <SQL>SELECT * FROM player_performance WHERE player_id = 204</SQL>
-    """
-
-    prompt += f"""
-    CRITICAL INSTRUCTIONS:
-    1. Replace placeholders with EXACT numeric values from metadata
-    2. Respond with ONLY: <SQL>SELECT ...</SQL>
-    3. NO explanations, NO extra text, NO markdown
-    4. If metadata value is None, remove the condition entirely
-    5. Ensure resulting SQL is syntactically correct
-
-    TemplateSQL: {template}
-    Metadata: {metadata}
-    <SQL>
-    """
-    
-    return prompt
-    
-
-
 def getIdentifyEntityPrompt(statement, queriedEntity, entityData):
     
     prompt = f"""
@@ -0,0 +1,533 @@
+import argparse
+import json
+import random
+import sys
+import time
+from transformers import AutoTokenizer
+
+from generation import stats_snapshot
+
+import classifyRecords
+from utils import load_record_labels, load_labelled_statements
+from cascade import RecordCascade, SportKNN, RECORD_CSV, SPORT_CSV, set_record_cascade, set_sport_knn
+from classifyRecords import build_prompt, build_prefix, build_suffix, build_system_prefix, build_examples, classify_records, get_example_index
+from classifySports import classify_sports, valid_sports
+from classifyFused import classify_fused
+
+
+def load_record_dataset(path=RECORD_CSV, limit=None):
+    statements, labels = load_record_labels(path)
+    return statements[:limit], labels[:limit]
+
+
+def prefill_tokens(statements):
+    """Prompt tokens prefilled per statement with full prompts vs. a reused few-shot prefix."""
+
+    tokenizer = AutoTokenizer.from_pretrained(classifyRecords.MODEL, local_files_only=True)
+
+    full = [len(tokenizer(build_prompt(s)).input_ids) for s in statements]
+    prefix_length = len(tokenizer(build_prefix()).input_ids)
+    suffixes = [len(tokenizer(build_suffix(s), add_special_tokens=False).input_ids) for s in statements]
+
+    n = len(statements)
+    return {
+        "statements": n,
+        "prefix_tokens": prefix_length,
+        "prefill_tokens_per_statement_before": sum(full) / n,
+        "prefill_tokens_per_statement_after": sum(suffixes) / n,
+        "prefill_tokens_per_statement_after_amortized": (sum(suffixes) + prefix_length) / n,
+    }
+
+
+def benchmark_prefix_cache(statements, batch_size, timed=False):
+    report = prefill_tokens(statements)
+    print(f"Prefix: {report['prefix_tokens']} tokens shared by every prompt")
+    print(f"Prefill tokens/statement: {report['prefill_tokens_per_statement_before']:.1f} before, "
+          f"{report['prefill_tokens_per_statement_after']:.1f} after "
+          f"({report['prefill_tokens_per_statement_after_amortized']:.1f} with the prefix amortized)")
+
+    if timed:
+        for reuse_prefix in (False, True):
+            start = time.perf_counter()
+            labels = classify_records(statements, batch_size=batch_size, reuse_prefix=reuse_prefix)
+            elapsed = time.perf_counter() - start
+            key = "with_prefix_cache" if reuse_prefix else "without_prefix_cache"
+            report[key] = {"seconds": elapsed, "statements_per_sec": len(statements) / elapsed, "labels": labels}
+            print(f"{key}: {len(statements) / elapsed:.2f} statements/sec")
+
+        before = report["without_prefix_cache"].pop("labels")
+        after = report["with_prefix_cache"].pop("labels")
+        report["label_agreement"] = sum(a == b for a, b in zip(before, after)) / len(before)
+        print(f"Label agreement: {report['label_agreement']:.1%}")
+
+    return report
+
+
+def accuracy(predicted, labels):
+    return sum(p == l for p, l in zip(predicted, labels)) / len(labels)
+
+
+def benchmark_packing(statements, labels, pack_sizes, batch_size):
+    """Accuracy against the human labels and throughput of classify_records at each pack size."""
+
+    report = {}
+    for pack_size in pack_sizes:
+        start = time.perf_counter()
+        predicted = classify_records(statements, batch_size=batch_size, pack_size=pack_size)
+        elapsed = time.perf_counter() - start
+        report[pack_size] = {
+            "accuracy": accuracy(predicted, labels),
+            "seconds": elapsed,
+            "statements_per_sec": len(statements) / elapsed,
+        }
+        print(f"pack_size={pack_size}: {report[pack_size]['accuracy']:.1%} accuracy, "
+              f"{report[pack_size]['statements_per_sec']:.2f} statements/sec")
+    return report
+
+
+def benchmark_cascade(statements, labels, thresholds, test_fraction=0.2, run_llm=False, batch_size=classifyRecords.BATCH_SIZE,
+                      seed=0):
+    """Train the record cascade on part of the human labels and measure each tier on the held-out rest."""
+
+    order = list(range(len(statements)))
+    random.Random(seed).shuffle(order)
+    statements, labels = [statements[i] for i in order], [labels[i] for i in order]
+
+    split = int(len(statements) * (1 - test_fraction))
+    cascade = RecordCascade.train(statements[:split], labels[:split])
+    test_statements, test_labels = statements[split:], labels[split:]
+    probs = cascade.predict_proba(test_statements)
+
+    report = {"train": split, "test": len(test_statements), "thresholds": {}}
+    for non_record_below, record_above in thresholds:
+        cascade.set_thresholds(non_record_below, record_above)
+        decided = [i for i, p in enumerate(probs) if p <= non_record_below or p >= record_above]
+        escalated = [i for i, p in enumerate(probs) if non_record_below < p < record_above]
+
+        tier = {
+            "escalation_rate": len(escalated) / len(test_statements),
+            "embedding_accuracy": accuracy(
+                ["Record" if probs[i] >= record_above else "Non-Record" for i in decided],
+                [test_labels[i] for i in decided]
+            ) if decided else None,
+        }
+        if run_llm and escalated:
+            predicted = classify_records([test_statements[i] for i in escalated], batch_size=batch_size)
+            tier["llm_accuracy"] = accuracy(predicted, [test_labels[i] for i in escalated])
+
+        report["thresholds"][f"{non_record_below}-{record_above}"] = tier
+        llm = f", LLM tier {tier['llm_accuracy']:.1%}" if "llm_accuracy" in tier else ""
+        embedding = f"{tier['embedding_accuracy']:.1%}" if decided else "-"
+        print(f"thresholds ({non_record_below}, {record_above}): {tier['escalation_rate']:.1%} escalated, "
+              f"embedding tier {embedding}{llm}")
+
+    return report
+
+
+def benchmark_sport_knn(rows, agreements, k, test_fraction=0.2, run_llm=False, seed=0, min_similarity=None):
+    """Build the sport kNN index on part of the human labels and measure each tier on the held-out rest."""
+
+    rows = list(rows)
+    random.Random(seed).shuffle(rows)
+    split = int(len(rows) * (1 - test_fraction))
+    train, test = rows[:split], rows[split:]
+    knn = SportKNN.build([r["statement"] for r in train], [r["sport"] for r in train], k=k)
+    statements, sports = [r["statement"] for r in test], [r["sport"] for r in test]
+    neighbours = knn.neighbours(statements)
+
+    report = {"train": len(train), "test": len(test), "k": k, "min_similarity": min_similarity or knn.min_similarity,
+              "agreement": {}}
+    for agreement in agreements:
+        predicted = [knn.vote(n, agreement, min_similarity) for n in neighbours]
+        decided = [i for i, p in enumerate(predicted) if p is not None]
+        escalated = [i for i, p in enumerate(predicted) if p is None]
+
+        tier = {
+            "escalation_rate": len(escalated) / len(test),
+            "knn_accuracy": accuracy([predicted[i] for i in decided], [sports[i] for i in decided]) if decided else None,
+        }
+        if run_llm and escalated:
+            results = classify_sports([statements[i] for i in escalated])
+            tier["llm_accuracy"] = accuracy([r["sport"] for r in results], [sports[i] for i in escalated])
+
+        report["agreement"][str(agreement)] = tier
+        llm = f", LLM tier {tier['llm_accuracy']:.1%}" if "llm_accuracy" in tier else ""
+        knn_accuracy = f"{tier['knn_accuracy']:.1%}" if decided else "-"
+        print(f"agreement {agreement}: {tier['escalation_rate']:.1%} escalated, kNN tier {knn_accuracy}{llm}")
+
+    return report
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def benchmark_fused(record_statements, record_labels, sport_rows, batch_size):
+    """Latency and accuracy of the fused classifier against the two-stage record + sport classifiers."""
+
+    records, records_s = timed(classify_records, record_statements, batch_size=batch_size)
+    found = [s for s, label in zip(record_statements, records) if label == "Record"]
+    _, sports_s = timed(classify_sports, found)
+    fused, fused_s = timed(classify_fused, record_statements, batch_size=batch_size)
+
+    sport_statements, sports = [r["statement"] for r in sport_rows], [r["sport"] for r in sport_rows]
+    two_stage_sports, two_stage_sport_s = timed(classify_sports, sport_statements)
+    fused_sports, fused_sport_s = timed(classify_fused, sport_statements, batch_size=batch_size)
+
+    report = {
+        "records": {
+            "statements": len(record_statements),
+            "two_stage": {"seconds": records_s + sports_s, "record_accuracy": accuracy(records, record_labels)},
+            "fused": {"seconds": fused_s, "record_accuracy": accuracy([r["record"] for r in fused], record_labels)},
+        },
+        "sports": {
+            "statements": len(sport_statements),
+            "two_stage": {"seconds": two_stage_sport_s, "sport_accuracy": accuracy([r["sport"] for r in two_stage_sports], sports)},
+            "fused": {"seconds": fused_sport_s, "sport_accuracy": accuracy([r["sport"] for r in fused_sports], sports)},
+        },
+    }
+
+    for dataset, metric in (("records", "record_accuracy"), ("sports", "sport_accuracy")):
+        for mode in ("two_stage", "fused"):
+            r = report[dataset][mode]
+            print(f"{dataset} / {mode}: {r['seconds']:.1f}s, {r[metric]:.1%} {metric.replace('_', ' ')}")
+    return report
+
+
+def benchmark_few_shot(statements, labels, ks, include_human=False, run_llm=False, batch_size=classifyRecords.BATCH_SIZE):
+    """Prompt tokens per statement with all few-shot examples vs. the k retrieved ones, and the accuracy of each."""
+
+    tokenizer = AutoTokenizer.from_pretrained(classifyRecords.MODEL, local_files_only=True)
+    index = get_example_index(include_human)
+
+    def mean_tokens(prompts):
+        return sum(len(tokenizer(p).input_ids) for p in prompts) / len(prompts)
+
+    report = {"all_examples": {"prompt_tokens": mean_tokens([build_prompt(s) for s in statements])}}
+    if run_llm:
+        report["all_examples"]["accuracy"] = accuracy(classify_records(statements, batch_size=batch_size), labels)
+
+    for k in ks:
+        nearest = index.nearest(statements, k)
+        prompts = [build_system_prefix() + build_examples(ex[::-1]) + build_suffix(s) for s, ex in zip(statements, nearest)]
+        report[f"k={k}"] = {"prompt_tokens": mean_tokens(prompts)}
+        if run_llm:
+            predicted = classify_records(statements, batch_size=batch_size, few_shot_k=k, few_shot_human=include_human)
+            report[f"k={k}"]["accuracy"] = accuracy(predicted, labels)
+
+    for name, r in report.items():
+        accuracy_note = f", {r['accuracy']:.1%} accuracy" if "accuracy" in r else ""
+        print(f"{name}: {r['prompt_tokens']:.0f} prompt tokens/statement{accuracy_note}")
+    return report
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def precision_recall(predicted, labels, positive):
+    true_positive = sum(p == positive and l == positive for p, l in zip(predicted, labels))
+    predicted_positive = sum(p == positive for p in predicted)
+    actual_positive = sum(l == positive for l in labels)
+    return (
+        true_positive / predicted_positive if predicted_positive else 0.0,
+        true_positive / actual_positive if actual_positive else 0.0,
+    )
+
+
+def run_timed_batches(fn, statements, batch_size):
+    """Call `fn` one batch at a time; returns outputs, per-batch latencies and the tokens the batches used."""
+
+    outputs, latencies = [], []
+    before = stats_snapshot()
+    for start in range(0, len(statements), batch_size):
+        batch_start = time.perf_counter()
+        outputs.extend(fn(statements[start:start + batch_size]))
+        latencies.append(time.perf_counter() - batch_start)
+    after = stats_snapshot()
+    tokens = {k: after[k] - before[k] for k in ("prompt_tokens", "generated_tokens", "generate_calls")}
+    return outputs, latencies, tokens
+
+
+def stage_report(predicted, labels, positives, latencies, tokens):
+    """Accuracy, per-label precision/recall with support, and throughput of one stage.
+
+    Precision and recall are macro-averaged over the labels that occur in `labels`; a label with no gold
+    statements is reported but left out of the averages.
+    """
+
+    elapsed = sum(latencies)
+    per_label = {}
+    for positive in positives:
+        precision, recall = precision_recall(predicted, labels, positive)
+        per_label[positive] = {"precision": precision, "recall": recall, "support": labels.count(positive)}
+    supported = [r for r in per_label.values() if r["support"]]
+
+    return {
+        "statements": len(labels),
+        "accuracy": accuracy(predicted, labels),
+        "precision": sum(r["precision"] for r in supported) / len(supported) if supported else 0.0,
+        "recall": sum(r["recall"] for r in supported) / len(supported) if supported else 0.0,
+        "per_label": per_label,
+        "seconds": elapsed,
+        "statements_per_sec": len(labels) / elapsed if elapsed else 0.0,
+        "prompt_tokens_per_sec": tokens["prompt_tokens"] / elapsed if elapsed else 0.0,
+        "generated_tokens_per_sec": tokens["generated_tokens"] / elapsed if elapsed else 0.0,
+        "generate_calls": tokens["generate_calls"],
+        "batch_latency_p50": percentile(latencies, 50),
+        "batch_latency_p95": percentile(latencies, 95),
+    }
+
+
+def held_out(items, test_fraction, seed):
+    """Shuffled (train, test) split of `items`."""
+    items = list(items)
+    random.Random(seed).shuffle(items)
+    split = int(len(items) * (1 - test_fraction))
+    return items[:split], items[split:]
+
+
+def benchmark_stages(record_limit=None, sport_limit=None, batch_size=classifyRecords.BATCH_SIZE,
+                     record_mode="generate", sport_mode="generate", test_fraction=0.2, seed=0):
+    """Accuracy and throughput of classify_records and classify_sports against the human-labelled CSVs.
+
+    Precision and recall are for the "Record" label in the record stage, and macro-averaged over the sports
+    present in the gold labels in the sport stage ("unknown" always counts as a miss). The record cascade
+    and sport kNN are built from those same CSVs, so in those modes they are rebuilt on a training split
+    and scored on the held-out rest only.
+    """
+
+    statements, labels = load_record_dataset()
+    record_eval = {"split": "all"}
+    if record_mode == "cascade":
+        train, test = held_out(zip(statements, labels), test_fraction, seed)
+        set_record_cascade(RecordCascade.train([s for s, _ in train], [l for _, l in train]))
+        statements, labels = [s for s, _ in test], [l for _, l in test]
+        record_eval = {"split": "held_out", "train": len(train)}
+    statements, labels = statements[:record_limit], labels[:record_limit]
+    predicted, latencies, tokens = run_timed_batches(
+        lambda batch: classify_records(batch, batch_size=batch_size, progress=False, mode=record_mode),
+        statements, batch_size
+    )
+    records = dict(stage_report(predicted, labels, ["Record"], latencies, tokens), evaluation=record_eval)
+
+    rows = load_labelled_statements(SPORT_CSV)
+    sport_eval = {"split": "all"}
+    if sport_mode == "knn":
+        train, rows = held_out(rows, test_fraction, seed)
+        set_sport_knn(SportKNN.build([r["statement"] for r in train], [r["sport"] for r in train]))
+        sport_eval = {"split": "held_out", "train": len(train)}
+    rows = rows[:sport_limit]
+    sport_statements, sports = [r["statement"] for r in rows], [r["sport"] for r in rows]
+    predicted, latencies, tokens = run_timed_batches(
+        lambda batch: [r["sport"] for r in classify_sports(batch, batch_size=batch_size, progress=False, mode=sport_mode)],
+        sport_statements, batch_size
+    )
+    sport_stage = dict(stage_report(predicted, sports, valid_sports, latencies, tokens), evaluation=sport_eval)
+
+    report = {
+        "config": {"batch_size": batch_size, "record_mode": record_mode, "sport_mode": sport_mode,
+                   "record_limit": record_limit, "sport_limit": sport_limit, "test_fraction": test_fraction, "seed": seed},
+        "records": records,
+        "sports": sport_stage,
+    }
+
+    print(f"\n{'Stage':<10}{'Prec':>7}{'Recall':>8}{'Stmt/s':>9}{'Prompt tok/s':>14}{'Gen tok/s':>11}{'p50 s':>8}{'p95 s':>8}")
+    for stage in ("records", "sports"):
+        r = report[stage]
+        print(f"{stage:<10}{r['precision']:>7.3f}{r['recall']:>8.3f}{r['statements_per_sec']:>9.2f}"
+              f"{r['prompt_tokens_per_sec']:>14.1f}{r['generated_tokens_per_sec']:>11.1f}"
+              f"{r['batch_latency_p50']:>8.2f}{r['batch_latency_p95']:>8.2f}")
+
+    print(f"\n{'Stage':<10}{'Label':<12}{'Prec':>7}{'Recall':>8}{'Support':>9}")
+    for stage in ("records", "sports"):
+        for label, r in report[stage]["per_label"].items():
+            print(f"{stage:<10}{label:<12}{r['precision']:>7.3f}{r['recall']:>8.3f}{r['support']:>9}")
+        if report[stage]["evaluation"]["split"] == "held_out":
+            print(f"{stage}: scored on {report[stage]['statements']} held-out statements "
+                  f"(trained on {report[stage]['evaluation']['train']})")
+    return report
+
+
+# Metric -> direction that counts as better; a regression is a move the other way beyond the tolerance.
+REGRESSION_METRICS = {
+    "accuracy": "higher", "precision": "higher", "recall": "higher",
+    "statements_per_sec": "higher", "generated_tokens_per_sec": "higher",
+    "batch_latency_p50": "lower", "batch_latency_p95": "lower",
+}
+
+
+def compare_reports(report, baseline, quality_tolerance=0.01, speed_tolerance=0.1):
+    """Regressions of `report` against `baseline`.
+
+    Quality metrics may drop by `quality_tolerance` (absolute) and speed metrics may worsen by
+    `speed_tolerance` (relative) before they are flagged.
+    """
+
+    regressions = []
+    for stage in ("records", "sports"):
+        for metric, better in REGRESSION_METRICS.items():
+            old, new = baseline.get(stage, {}).get(metric), report[stage].get(metric)
+            if old is None or new is None:
+                continue
+            if metric in ("accuracy", "precision", "recall"):
+                regressed = new < old - quality_tolerance
+            elif better == "higher":
+                regressed = new < old * (1 - speed_tolerance)
+            else:
+                regressed = new > old * (1 + speed_tolerance)
+            if regressed:
+                regressions.append({"stage": stage, "metric": metric, "baseline": old, "current": new})
+
+    for r in regressions:
+        print(f"REGRESSION {r['stage']}.{r['metric']}: {r['baseline']:.4g} -> {r['current']:.4g}")
+    if not regressions:
+        print("No regressions against the baseline")
+    return regressions
+
+
+def benchmark_entity_gate(path, precision, thresholds_path):
+    """Calibrate each sport's entity fast-path threshold on labelled (sport, mention, player_id) matches and save them."""
+    import pandas as pd
+    from sports import SportsProcessor, calibrate_entity_threshold, save_entity_thresholds
+
+    df = pd.read_csv(path)
+    report = {}
+    for sport, group in df.groupby("sport"):
+        processor = SportsProcessor(sport)
+        mentions = group["mention"].astype(str).tolist()
+        matches = processor.findEntityMatches(mentions, "player")
+        similarities = [matches[m][0][1] if matches.get(m) else 0.0 for m in mentions]
+        correct = [bool(matches.get(m)) and str(matches[m][0][0]) == str(pid) for m, pid in zip(mentions, group["player_id"])]
+        threshold = calibrate_entity_threshold(similarities, correct, precision)
+        accepted = [ok for sim, ok in zip(similarities, correct) if threshold is not None and sim >= threshold]
+        report[sport] = {
+            "matches": len(mentions),
+            "top1_accuracy": sum(correct) / len(correct),
+            "threshold": threshold,
+            "accepted": len(accepted),
+            "accepted_precision": sum(accepted) / len(accepted) if accepted else None,
+        }
+        shown = f"{threshold:.3f}" if threshold is not None else "none (name matches only)"
+        print(f"{sport}: threshold {shown}, {len(accepted)}/{len(mentions)} accepted, "
+              f"top-1 accuracy {report[sport]['top1_accuracy']:.1%}")
+
+    save_entity_thresholds({sport: r["threshold"] for sport, r in report.items() if r["threshold"] is not None}, thresholds_path)
+    print(f"Entity thresholds saved to {thresholds_path}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the classification stages")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    prefix_parser = subparsers.add_parser("prefix-cache", help="Prefill tokens per statement with and without the few-shot KV prefix cache")
+    prefix_parser.add_argument("--limit", type=int, default=200)
+    prefix_parser.add_argument("--batch-size", type=int, default=classifyRecords.BATCH_SIZE)
+    prefix_parser.add_argument("--time", action="store_true", help="Also run classify_records both ways and time it")
+    prefix_parser.add_argument("--output", default=None)
+
+    packing_parser = subparsers.add_parser("packing", help="Accuracy and throughput of classify_records across pack sizes")
+    packing_parser.add_argument("--pack-sizes", type=int, nargs="+", default=[1, 4, 8, 16])
+    packing_parser.add_argument("--limit", type=int, default=200)
+    packing_parser.add_argument("--batch-size", type=int, default=classifyRecords.BATCH_SIZE)
+    packing_parser.add_argument("--output", default=None)
+
+    cascade_parser = subparsers.add_parser("cascade", help="Escalation rate and per-tier accuracy of the embedding record cascade")
+    cascade_parser.add_argument("--thresholds", type=float, nargs=2, action="append", metavar=("NON_RECORD_BELOW", "RECORD_ABOVE"))
+    cascade_parser.add_argument("--test-fraction", type=float, default=0.2)
+    cascade_parser.add_argument("--llm", action="store_true", help="Also run the LLM on escalated statements")
+    cascade_parser.add_argument("--batch-size", type=int, default=classifyRecords.BATCH_SIZE)
+    cascade_parser.add_argument("--output", default=None)
+
+    knn_parser = subparsers.add_parser("sport-knn", help="Escalation rate and per-tier accuracy of the kNN sport classifier")
+    knn_parser.add_argument("--agreement", type=float, nargs="+", default=[0.6, 0.8, 1.0])
+    knn_parser.add_argument("--k", type=int, default=5)
+    knn_parser.add_argument("--min-similarity", type=float, default=None)
+    knn_parser.add_argument("--test-fraction", type=float, default=0.2)
+    knn_parser.add_argument("--llm", action="store_true", help="Also run the LLM on escalated statements")
+    knn_parser.add_argument("--output", default=None)
+
+    fused_parser = subparsers.add_parser("fused", help="Latency and accuracy of fused vs two-stage record and sport classification")
+    fused_parser.add_argument("--limit", type=int, default=200)
+    fused_parser.add_argument("--batch-size", type=int, default=classifyRecords.BATCH_SIZE)
+    fused_parser.add_argument("--output", default=None)
+
+    few_shot_parser = subparsers.add_parser("few-shot", help="Prompt size and accuracy with retrieved vs. all few-shot examples")
+    few_shot_parser.add_argument("--k", type=int, nargs="+", default=[4, 8, 16])
+    few_shot_parser.add_argument("--human", action="store_true", help="Also retrieve from the human-labelled CSV")
+    few_shot_parser.add_argument("--llm", action="store_true", help="Also run classify_records and report accuracy")
+    few_shot_parser.add_argument("--limit", type=int, default=200)
+    few_shot_parser.add_argument("--batch-size", type=int, default=classifyRecords.BATCH_SIZE)
+    few_shot_parser.add_argument("--output", default=None)
+
+    stages_parser = subparsers.add_parser("stages", help="Precision, recall and throughput of the record and sport classifiers")
+    stages_parser.add_argument("--record-limit", type=int, default=None)
+    stages_parser.add_argument("--sport-limit", type=int, default=None)
+    stages_parser.add_argument("--batch-size", type=int, default=classifyRecords.BATCH_SIZE)
+    stages_parser.add_argument("--record-mode", default="generate")
+    stages_parser.add_argument("--sport-mode", default="generate")
+    stages_parser.add_argument("--test-fraction", type=float, default=0.2,
+                               help="Held-out share scored in cascade/knn modes, whose classifiers train on the same CSVs")
+    stages_parser.add_argument("--baseline", default=None, help="Earlier stages report to flag regressions against")
+    stages_parser.add_argument("--quality-tolerance", type=float, default=0.01)
+    stages_parser.add_argument("--speed-tolerance", type=float, default=0.1)
+    stages_parser.add_argument("--output", default="benchmark_report.json")
+
+    gate_parser = subparsers.add_parser("entity-gate", help="Calibrate per-sport similarity thresholds for the entity fast path")
+    gate_parser.add_argument("matches", help="CSV of sport, mention, player_id: each mention with its correct player")
+    gate_parser.add_argument("--thresholds", default=None, help="Where to save the thresholds (default sports.ENTITY_THRESHOLDS_PATH)")
+    gate_parser.add_argument("--precision", type=float, default=None)
+    gate_parser.add_argument("--output", default=None)
+
+    args = parser.parse_args()
+
+    if args.command == "prefix-cache":
+        statements, _ = load_record_dataset(limit=args.limit)
+        report = benchmark_prefix_cache(statements, args.batch_size, timed=args.time)
+    elif args.command == "packing":
+        statements, labels = load_record_dataset(limit=args.limit)
+        report = benchmark_packing(statements, labels, args.pack_sizes, args.batch_size)
+    elif args.command == "cascade":
+        statements, labels = load_record_dataset()
+        thresholds = args.thresholds or [(0.05, 0.95), (0.1, 0.9), (0.2, 0.8)]
+        report = benchmark_cascade(statements, labels, thresholds, args.test_fraction, args.llm, args.batch_size)
+    elif args.command == "sport-knn":
+        rows = load_labelled_statements(SPORT_CSV)
+        report = benchmark_sport_knn(rows, args.agreement, args.k, args.test_fraction, args.llm, min_similarity=args.min_similarity)
+    elif args.command == "fused":
+        statements, labels = load_record_dataset(limit=args.limit)
+        rows = load_labelled_statements(SPORT_CSV)[:args.limit]
+        report = benchmark_fused(statements, labels, rows, args.batch_size)
+    elif args.command == "few-shot":
+        statements, labels = load_record_dataset(limit=args.limit)
+        report = benchmark_few_shot(statements, labels, args.k, args.human, args.llm, args.batch_size)
+    elif args.command == "stages":
+        report = benchmark_stages(args.record_limit, args.sport_limit, args.batch_size, args.record_mode, args.sport_mode,
+                                  args.test_fraction)
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            report["regressions"] = compare_reports(report, baseline, args.quality_tolerance, args.speed_tolerance)
+
+    elif args.command == "entity-gate":
+        import sports
+        report = benchmark_entity_gate(args.matches, args.precision or sports.ENTITY_GATE_PRECISION,
+                                       args.thresholds or sports.ENTITY_THRESHOLDS_PATH)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
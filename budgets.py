@@ -0,0 +1,73 @@
+import os
+import json
+import math
+
+import numpy as np
+
+
+# max_new_tokens for a (sport, stage) is the BUDGET_PERCENTILE output length seen so far times BUDGET_HEADROOM,
+# rounded up to a power of two so budgets (and generation cache keys) stay stable from run to run.
+BUDGET_PERCENTILE = 99
+BUDGET_HEADROOM = 1.25
+MIN_BUDGET = 16
+# Below MIN_OBSERVATIONS lengths a stage keeps the full cap; only the latest MAX_OBSERVATIONS are kept.
+MIN_OBSERVATIONS = 50
+MAX_OBSERVATIONS = 5000
+
+
+_budgets = None
+
+
+class GenerationBudgets:
+    """Output-length distributions per (sport, stage), persisted as JSON, and the max_new_tokens budgets derived from them."""
+
+    def __init__(self, path="generation_budgets.json"):
+        self.path = path
+        self.lengths = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.lengths = json.load(f)
+        self.stats = {}
+
+    @staticmethod
+    def _key(sport, stage):
+        return f"{sport}:{stage}"
+
+    def budget(self, sport, stage, cap):
+        lengths = self.lengths.get(self._key(sport, stage), [])
+        if len(lengths) < MIN_OBSERVATIONS:
+            return cap
+        target = max(MIN_BUDGET, np.percentile(lengths, BUDGET_PERCENTILE) * BUDGET_HEADROOM)
+        return min(cap, 2 ** math.ceil(math.log2(target)))
+
+    def record(self, sport, stage, lengths, retried=0):
+        key = self._key(sport, stage)
+        self.lengths[key] = (self.lengths.get(key, []) + list(lengths))[-MAX_OBSERVATIONS:]
+        stats = self.stats.setdefault(key, {"outputs": 0, "retried": 0})
+        stats["outputs"] += len(lengths)
+        stats["retried"] += retried
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump(self.lengths, f)
+
+    def report(self, cap):
+        print(f"\n{'Budget':<20}{'Seen':>7}{'p' + str(BUDGET_PERCENTILE):>7}{'Budget':>8}{'Outputs':>9}{'Retried':>9}")
+        report = {}
+        for key, lengths in self.lengths.items():
+            sport, stage = key.split(":", 1)
+            stats = self.stats.get(key, {"outputs": 0, "retried": 0})
+            report[key] = dict(stats, observations=len(lengths), budget=self.budget(sport, stage, cap),
+                               percentile=float(np.percentile(lengths, BUDGET_PERCENTILE)) if lengths else 0.0)
+            r = report[key]
+            print(f"{key:<20}{r['observations']:>7}{r['percentile']:>7.0f}{r['budget']:>8}{r['outputs']:>9}{r['retried']:>9}")
+        return report
+
+
+def set_generation_budgets(budgets):
+    global _budgets
+    _budgets = budgets
+
+
+def get_generation_budgets():
+    return _budgets
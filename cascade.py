@@ -0,0 +1,249 @@
+import os
+
+import numpy as np
+import torch
+
+from models import get_embedding_function
+from utils import load_record_labels, load_labelled_statements
+
+
+RECORD_CSV = 'LABELLED_DATASETS/Human/record_statements.csv'
+RECORD_CASCADE_PATH = 'vector_db/record_cascade.npz'
+
+# P(Record) at or below NON_RECORD_BELOW is labelled Non-Record on CPU, at or above RECORD_ABOVE Record;
+# anything in between is escalated to the LLM.
+NON_RECORD_BELOW = 0.1
+RECORD_ABOVE = 0.9
+
+
+def embed_statements(statements):
+    return np.array(get_embedding_function().embed_documents(list(statements)), dtype=np.float32)
+
+
+def train_logistic(features, targets, epochs=500, lr=0.1, weight_decay=1e-4):
+    """Full-batch logistic regression; returns (weights, bias) as numpy arrays."""
+
+    X = torch.from_numpy(features)
+    y = torch.tensor(targets, dtype=torch.float32)
+    weights = torch.zeros(X.shape[1], requires_grad=True)
+    bias = torch.zeros(1, requires_grad=True)
+    optimizer = torch.optim.Adam([weights, bias], lr=lr, weight_decay=weight_decay)
+
+    for _ in range(epochs):
+        optimizer.zero_grad()
+        loss = torch.nn.functional.binary_cross_entropy_with_logits(X @ weights + bias, y)
+        loss.backward()
+        optimizer.step()
+
+    return weights.detach().numpy(), bias.detach().numpy()
+
+
+class RecordCascade:
+    """First-tier Record/Non-Record classifier over MiniLM statement embeddings.
+
+    `decide` labels only the statements it is confident about and returns None for the rest,
+    which the caller escalates to the LLM.
+    """
+
+    def __init__(self, weights, bias, non_record_below=NON_RECORD_BELOW, record_above=RECORD_ABOVE):
+        self.weights = weights
+        self.bias = bias
+        self.set_thresholds(non_record_below, record_above)
+        self.stats = {"statements": 0, "decided": 0, "escalated": 0}
+
+    def set_thresholds(self, non_record_below=NON_RECORD_BELOW, record_above=RECORD_ABOVE):
+        if not 0.0 <= non_record_below < record_above <= 1.0:
+            raise ValueError(f"Need 0 <= non_record_below < record_above <= 1, got {non_record_below}, {record_above}")
+        self.non_record_below = non_record_below
+        self.record_above = record_above
+
+    @classmethod
+    def train(cls, statements, labels, **thresholds):
+        targets = [1.0 if label == "Record" else 0.0 for label in labels]
+        weights, bias = train_logistic(embed_statements(statements), targets)
+        return cls(weights, bias, **thresholds)
+
+    @classmethod
+    def load(cls, path=RECORD_CASCADE_PATH, csv_path=RECORD_CSV, **thresholds):
+        """Load saved weights, training (and saving) from the human-labelled CSV the first time."""
+
+        if os.path.isfile(path):
+            saved = np.load(path)
+            return cls(saved["weights"], saved["bias"], **thresholds)
+
+        print(f"Training record cascade on {csv_path}...")
+        cascade = cls.train(*load_record_labels(csv_path), **thresholds)
+        cascade.save(path)
+        return cascade
+
+    def save(self, path=RECORD_CASCADE_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez(path, weights=self.weights, bias=self.bias)
+
+    def predict_proba(self, statements):
+        if not statements:
+            return np.zeros(0, dtype=np.float32)
+        logits = embed_statements(statements) @ self.weights + self.bias
+        return 1.0 / (1.0 + np.exp(-logits))
+
+    def decide(self, statements):
+        """Label per statement, or None where P(Record) falls between the two thresholds."""
+
+        probs = self.predict_proba(statements)
+        labels = [
+            "Record" if p >= self.record_above else "Non-Record" if p <= self.non_record_below else None
+            for p in probs
+        ]
+
+        decided = sum(label is not None for label in labels)
+        self.stats["statements"] += len(labels)
+        self.stats["decided"] += decided
+        self.stats["escalated"] += len(labels) - decided
+        return labels
+
+    def report(self):
+        total = self.stats["statements"]
+        rate = self.stats["escalated"] / total if total else 0.0
+        print(f"Record cascade: {self.stats['decided']} decided on CPU, {self.stats['escalated']} escalated "
+              f"to the LLM ({rate:.1%} escalation rate)")
+        return dict(self.stats, escalation_rate=rate)
+
+
+_record_cascade = None
+
+
+def get_record_cascade(thresholds=None):
+    """Shared RecordCascade, loaded once; `thresholds` is an optional (non_record_below, record_above) pair."""
+    global _record_cascade
+    if _record_cascade is None:
+        _record_cascade = RecordCascade.load()
+    if thresholds is not None:
+        _record_cascade.set_thresholds(*thresholds)
+    return _record_cascade
+
+
+def set_record_cascade(cascade):
+    """Replace the shared RecordCascade, e.g. with one trained on a training split only."""
+    global _record_cascade
+    _record_cascade = cascade
+
+
+def record_cascade_report():
+    """Escalation stats of the shared RecordCascade, or None if it was never used."""
+    return _record_cascade.report() if _record_cascade is not None else None
+
+
+SPORT_CSV = 'LABELLED_DATASETS/Human/sport_statements.csv'
+SPORT_INDEX_PATH = 'vector_db/sport_knn_index.bin'
+SPORT_LABELS_PATH = 'vector_db/sport_knn_labels.npy'
+
+# A sport is answered from the index when at least SPORT_AGREEMENT of the SPORT_NEIGHBOURS nearest
+# labelled statements share it and are at least SPORT_MIN_SIMILARITY (cosine) close; otherwise the
+# statement goes to the LLM. Distant neighbours do not vote, so out-of-distribution statements (and
+# sports missing from the reference set) escalate instead of taking the nearest sport.
+SPORT_NEIGHBOURS = 5
+SPORT_AGREEMENT = 0.8
+SPORT_MIN_SIMILARITY = 0.5
+
+
+class SportKNN:
+    """Nearest-neighbour sport classifier over MiniLM embeddings of human-labelled sport statements.
+
+    Embeddings are L2-normalised and held in a flat inner-product FAISS index, so scores are cosine
+    similarities. `decide` returns None wherever the close neighbours disagree or are too few.
+    """
+
+    def __init__(self, index, labels, k=SPORT_NEIGHBOURS, agreement=SPORT_AGREEMENT, min_similarity=SPORT_MIN_SIMILARITY):
+        self.index = index
+        self.labels = np.asarray(labels)
+        self.k = k
+        self.agreement = agreement
+        self.min_similarity = min_similarity
+        self.stats = {"statements": 0, "decided": 0, "escalated": 0}
+
+    @classmethod
+    def build(cls, statements, sports, **kwargs):
+        import faiss
+
+        embeddings = embed_statements(statements)
+        faiss.normalize_L2(embeddings)
+        index = faiss.IndexFlatIP(embeddings.shape[1])
+        index.add(embeddings)
+        return cls(index, sports, **kwargs)
+
+    @classmethod
+    def load(cls, index_path=SPORT_INDEX_PATH, labels_path=SPORT_LABELS_PATH, csv_path=SPORT_CSV, **kwargs):
+        """Load the saved index, building (and saving) it from the human-labelled CSV the first time."""
+        import faiss
+
+        if os.path.isfile(index_path) and os.path.isfile(labels_path):
+            return cls(faiss.read_index(index_path), np.load(labels_path), **kwargs)
+
+        print(f"Building sport kNN index from {csv_path}...")
+        rows = load_labelled_statements(csv_path)
+        knn = cls.build([r["statement"] for r in rows], [r["sport"] for r in rows], **kwargs)
+        knn.save(index_path, labels_path)
+        return knn
+
+    def save(self, index_path=SPORT_INDEX_PATH, labels_path=SPORT_LABELS_PATH):
+        import faiss
+
+        os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+        faiss.write_index(self.index, index_path)
+        np.save(labels_path, self.labels)
+
+    def neighbours(self, statements):
+        """(sport, cosine similarity) of the k nearest labelled statements for each statement."""
+        import faiss
+
+        if not statements:
+            return []
+        embeddings = embed_statements(statements)
+        faiss.normalize_L2(embeddings)
+        scores, ids = self.index.search(embeddings, self.k)
+        return [[(str(self.labels[i]), float(score)) for i, score in zip(row_ids, row_scores) if i >= 0]
+                for row_ids, row_scores in zip(ids, scores)]
+
+    def vote(self, neighbours, agreement=None, min_similarity=None):
+        """Sport shared by at least `agreement` of the k neighbours among those `min_similarity` close, else None."""
+        agreement = self.agreement if agreement is None else agreement
+        min_similarity = self.min_similarity if min_similarity is None else min_similarity
+        votes = [sport for sport, similarity in neighbours if similarity >= min_similarity]
+        best = max(set(votes), key=votes.count) if votes else None
+        return best if best and votes.count(best) >= agreement * self.k else None
+
+    def decide(self, statements):
+        sports = [self.vote(neighbours) for neighbours in self.neighbours(statements)]
+
+        decided = sum(sport is not None for sport in sports)
+        self.stats["statements"] += len(sports)
+        self.stats["decided"] += decided
+        self.stats["escalated"] += len(sports) - decided
+        return sports
+
+    def report(self):
+        total = self.stats["statements"]
+        rate = self.stats["escalated"] / total if total else 0.0
+        print(f"Sport kNN: {self.stats['decided']} decided on CPU, {self.stats['escalated']} escalated "
+              f"to the LLM ({rate:.1%} escalation rate)")
+        return dict(self.stats, escalation_rate=rate)
+
+
+_sport_knn = None
+
+
+def get_sport_knn():
+    global _sport_knn
+    if _sport_knn is None:
+        _sport_knn = SportKNN.load()
+    return _sport_knn
+
+
+def set_sport_knn(knn):
+    global _sport_knn
+    _sport_knn = knn
+
+
+def sport_knn_report():
+    """Escalation stats of the shared SportKNN, or None if it was never used."""
+    return _sport_knn.report() if _sport_knn is not None else None
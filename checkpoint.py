@@ -0,0 +1,76 @@
+import json
+import hashlib
+import sqlite3
+from tqdm import tqdm
+
+from utils import statement_key
+from generation import BUCKET_BATCHES
+
+
+STAGES = ["record", "sport", "fused", "qu", "metadata", "template", "sql"]
+
+
+class StageCheckpoint:
+    """Per-statement store of every stage output, so a rerun only computes what is missing."""
+
+    def __init__(self, path):
+        self.path = path
+        self.con = sqlite3.connect(path)
+        self.con.execute("""CREATE TABLE IF NOT EXISTS stage_outputs (
+            key TEXT, stage TEXT, value TEXT, PRIMARY KEY (key, stage)
+        )""")
+        self.con.commit()
+
+    @staticmethod
+    def statement_key(statement):
+        return hashlib.sha1(statement_key(statement).encode("utf-8")).hexdigest()
+
+    def get_many(self, stage, statements):
+        keys = [self.statement_key(s) for s in statements]
+        found = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self.con.execute(
+                f"SELECT key, value FROM stage_outputs WHERE stage = ? AND key IN ({','.join('?' * len(chunk))})",
+                [stage, *chunk]
+            ).fetchall()
+            found.update((k, json.loads(v)) for k, v in rows)
+        return {idx: found[k] for idx, k in enumerate(keys) if k in found}
+
+    def put_many(self, stage, statements, values):
+        self.con.executemany(
+            "INSERT OR REPLACE INTO stage_outputs (key, stage, value) VALUES (?, ?, ?)",
+            [(self.statement_key(s), stage, json.dumps(v, default=str)) for s, v in zip(statements, values)]
+        )
+        self.con.commit()
+
+    def close(self):
+        self.con.close()
+
+
+def run_stage(checkpoint, stage, statements, items, fn, batch_size, progress=True, scope=None):
+    """Run `fn` over `items` (one per statement), skipping statements whose `stage` output is saved.
+
+    Outputs are persisted after every chunk of BUCKET_BATCHES generation batches (enough for length
+    bucketing to cut padding), so a crash mid-stage only repeats the unfinished chunk.
+    `scope` (the sport for the SQL stages, the mode for the classifiers) is saved with the stage, so a
+    statement rerun under another sport or mode is computed afresh rather than restored.
+    """
+
+    if checkpoint is None:
+        return fn(items)
+
+    saved_as = f"{stage}:{scope}" if scope else stage
+    outputs = checkpoint.get_many(saved_as, statements)
+    missing = [i for i in range(len(statements)) if i not in outputs]
+    if outputs and progress:
+        print(f"[{stage}] {len(outputs)} of {len(statements)} statements restored from checkpoint")
+
+    chunk_size = batch_size * BUCKET_BATCHES
+    for start in tqdm(range(0, len(missing), chunk_size), desc=f"Stage {stage}", disable=not (missing and progress)):
+        idxs = missing[start:start + chunk_size]
+        values = fn([items[i] for i in idxs])
+        checkpoint.put_many(saved_as, [statements[i] for i in idxs], values)
+        outputs.update(zip(idxs, values))
+
+    return [outputs[i] for i in range(len(statements))]
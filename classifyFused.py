@@ -0,0 +1,78 @@
+import json
+import torch
+
+from models import get_model
+from generation import continuation_token_ids, score_positions
+from classifyRecords import system_prompt, examples_data, RECORD_CONTINUATIONS, BATCH_SIZE
+from classifySports import valid_sports, sport_token_ids, sport_probs, best_sport, UNKNOWN_THRESHOLD
+
+
+# Sport of each entry in classifyRecords.examples_data, in the same order.
+EXAMPLE_SPORTS = [
+    # Record
+    "cricket", "cricket", "cricket", "cricket", "cricket", "cricket", "cricket", "cricket", "cricket", "soccer",
+    "baseball", "baseball", "baseball", "baseball", "baseball", "baseball", "baseball", "baseball",
+    "soccer", "soccer", "baseball", "soccer", "cricket", "cricket",
+    # Non Record
+    "baseball", "basketball", "cricket", "soccer", "soccer", "soccer", "soccer", "soccer", "soccer", "soccer",
+    "soccer", "soccer", "soccer", "soccer", "soccer", "soccer", "soccer", "soccer", "soccer", "cricket",
+    "soccer", "soccer", "cricket", "basketball",
+]
+assert len(EXAMPLE_SPORTS) == len(examples_data)
+
+fused_prompt = system_prompt.replace(
+    '''OUTPUT FORMAT:
+"<statement>" -> Record
+"<statement>" -> Non-Record
+''',
+    f'''SPORT:
+After the label, name the sport the statement is about: {", ".join(valid_sports)}.
+
+OUTPUT FORMAT:
+"<statement>" -> Record | <sport>
+"<statement>" -> Non-Record | <sport>
+''')
+
+# The sport is read right after this, so one forward pass over prompt + tail scores both answers.
+FUSED_TAIL = f"{RECORD_CONTINUATIONS['Record']} |"
+
+
+def build_fused_prompt(statement: str) -> str:
+    examples = "\n".join(f'{json.dumps(s)} -> {label} | {sport}' for (s, label), sport in zip(examples_data, EXAMPLE_SPORTS))
+    return f"{fused_prompt}\n{examples}\n{json.dumps(statement)} ->"
+
+
+def classify_fused(statements, batch_size=BATCH_SIZE, progress=True, threshold=UNKNOWN_THRESHOLD):
+    """Record/Non-Record label and sport for each statement from one forward pass of the record model.
+
+    The prompt is followed by the Record continuation, so the logits just before it give the label and
+    the logits at the end give the sport, conditioned on the statement being a Record.
+    """
+
+    tokenizer, model = get_model("classify_records")
+
+    label_ids = continuation_token_ids(tokenizer, list(RECORD_CONTINUATIONS.values()))
+    token_ids = sport_token_ids(tokenizer)
+    flat_sport_ids = [i for sport in valid_sports for i in token_ids[sport]]
+    tail_length = len(tokenizer.encode(FUSED_TAIL, add_special_tokens=False))
+
+    scores = score_positions(
+        tokenizer, model, [build_fused_prompt(s) + FUSED_TAIL for s in statements],
+        {tail_length + 1: label_ids, 1: flat_sport_ids},
+        batch_size=batch_size,
+        desc="Classifying Records and Sports",
+        progress=progress
+    )
+
+    results = []
+    for stmt, row in zip(statements, scores):
+        label_probs = torch.softmax(torch.tensor(row[tail_length + 1]), dim=0).tolist()
+        labels = list(RECORD_CONTINUATIONS)
+        probs = sport_probs(row[1], token_ids)
+        results.append({
+            "statement": stmt,
+            "record": labels[max(range(len(labels)), key=lambda k: label_probs[k])],
+            "sport": best_sport(probs, threshold),
+        })
+
+    return results
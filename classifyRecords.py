@@ -1,15 +1,23 @@
 import os
 import re
 import json
+import weakref
 import torch
 import pandas as pd
 from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
-from tqdm import tqdm
+
+from models import register_model, get_model
+from generation import generate, continuation_token_ids, score_continuations, PrefixCache
+from cascade import get_record_cascade, embed_statements, RECORD_CSV
+from utils import load_record_labels, statement_key
 
 
 MODEL = '/scratch/nitishk_iitp/models/Llama-3.3-70B-Instruct'
 BATCH_SIZE = 20
 
+# Continuations compared by the single-forward-pass scoring mode; the prompt ends with "->".
+RECORD_CONTINUATIONS = {"Record": " Record", "Non-Record": " Non-Record"}
+
 
 system_prompt = """Classify sport statements as "Record" or "Non-Record" based on these rules:
 
@@ -101,35 +109,148 @@ examples_data = [
 
 few_shot_examples = [f'{json.dumps(s)} -> {label}' for s, label in examples_data]
 
-def build_prompt(statement: str) -> str:
+def build_system_prefix() -> str:
+    return f"{system_prompt}\n"
+
+
+def build_examples(examples) -> str:
+    return "".join(f'{json.dumps(s)} -> {label}\n' for s, label in examples)
+
+
+def build_prefix() -> str:
     examples = "\n".join(few_shot_examples)
-    return f"{system_prompt}\n{examples}\n{json.dumps(statement)} ->"
+    return f"{system_prompt}\n{examples}\n"
+
+
+def build_suffix(statement: str) -> str:
+    return f"{json.dumps(statement)} ->"
+
+
+def build_prompt(statement: str) -> str:
+    return build_prefix() + build_suffix(statement)
+
+
+PACK_HEADER = "\nClassify each of the following statements. Reply with exactly one line per statement, in the same order, using the OUTPUT FORMAT above.\n"
+
+
+def build_packed_suffix(statements) -> str:
+    listed = "\n".join(json.dumps(s) for s in statements)
+    return f"{PACK_HEADER}{listed}\n\n"
+
+
+def build_packed_prompt(statements) -> str:
+    return build_prefix() + build_packed_suffix(statements)
+
+
+# {model: {prefix: PrefixCache}}; weakly keyed, so unloading a model also frees its prefix keys and values.
+_prefix_caches = weakref.WeakKeyDictionary()
+
+
+def get_prefix_cache(tokenizer, model, prefix=None):
+    """A shared prompt prefix (by default system prompt + few-shot examples), encoded once per loaded model."""
+    prefix = prefix if prefix is not None else build_prefix()
+    caches = _prefix_caches.setdefault(model, {})
+    if prefix not in caches:
+        caches[prefix] = PrefixCache(tokenizer, model, prefix)
+    return caches[prefix]
+
+
+# Few-shot examples picked per statement when classify_records is given few_shot_k.
+FEW_SHOT_K = 8
+
+
+class ExampleIndex:
+    """Labelled example statements in a flat inner-product FAISS index over normalised MiniLM embeddings."""
+
+    def __init__(self, examples):
+        import faiss
+
+        self.examples = list(examples)
+        self.keys = [statement_key(s) for s, _ in self.examples]
+        embeddings = embed_statements([s for s, _ in self.examples])
+        faiss.normalize_L2(embeddings)
+        self.index = faiss.IndexFlatIP(embeddings.shape[1])
+        self.index.add(embeddings)
+
+    def nearest(self, statements, k):
+        """The k most similar examples per statement, most similar first, never the statement itself."""
+        import faiss
+
+        if not statements:
+            return []
+        embeddings = embed_statements(statements)
+        faiss.normalize_L2(embeddings)
+        _, ids = self.index.search(embeddings, min(k + 1, len(self.examples)))
+
+        selected = []
+        for stmt, row in zip(statements, ids):
+            key = statement_key(stmt)
+            selected.append([self.examples[i] for i in row if i >= 0 and self.keys[i] != key][:k])
+        return selected
+
+
+_example_indexes = {}
+
+
+def get_example_index(include_human=False):
+    """Index over examples_data, plus the human-labelled record CSV when include_human is set."""
+    if include_human not in _example_indexes:
+        examples = list(examples_data)
+        if include_human:
+            examples += list(zip(*load_record_labels(RECORD_CSV)))
+        _example_indexes[include_human] = ExampleIndex(examples)
+    return _example_indexes[include_human]
+
+
+def record_prompts(tokenizer, model, statements, reuse_prefix=False, few_shot_k=None, few_shot_human=False):
+    """Prompts for `statements`, plus the PrefixCache they continue when reuse_prefix is set (else None).
+
+    With few_shot_k, each prompt carries only the k examples most similar to its statement (closest
+    last, right before the statement) and only the system prompt is shared between prompts.
+    """
+
+    if few_shot_k:
+        nearest = get_example_index(few_shot_human).nearest(statements, few_shot_k)
+        suffixes = [build_examples(examples[::-1]) + build_suffix(s) for s, examples in zip(statements, nearest)]
+        shared = build_system_prefix()
+    else:
+        suffixes = [build_suffix(s) for s in statements]
+        shared = build_prefix()
+
+    if reuse_prefix:
+        return suffixes, get_prefix_cache(tokenizer, model, shared)
+    return [shared + suffix for suffix in suffixes], None
 
 
-quant = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_use_double_quant=True,
-    bnb_4bit_quant_type="nf4",
-    bnb_4bit_compute_dtype=torch.bfloat16
-)
+def load_model():
+    quant = BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_use_double_quant=True,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_compute_dtype=torch.bfloat16
+    )
 
-tokenizer = AutoTokenizer.from_pretrained(
-    MODEL,
-    padding_side='left',
-    trust_remote_code=True,
-    local_files_only=True
-)
+    tokenizer = AutoTokenizer.from_pretrained(
+        MODEL,
+        padding_side='left',
+        trust_remote_code=True,
+        local_files_only=True
+    )
 
-if tokenizer.pad_token_id is None:
-    tokenizer.pad_token = tokenizer.eos_token
+    if tokenizer.pad_token_id is None:
+        tokenizer.pad_token = tokenizer.eos_token
 
-model = AutoModelForCausalLM.from_pretrained(
-    MODEL,
-    quantization_config=quant,
-    dtype=torch.bfloat16,
-    device_map="auto",
-    local_files_only=True
-)
+    model = AutoModelForCausalLM.from_pretrained(
+        MODEL,
+        quantization_config=quant if torch.cuda.is_available() else None,
+        dtype=torch.bfloat16,
+        device_map="auto",
+        local_files_only=True
+    )
+    return tokenizer, model
+
+
+register_model("classify_records", load_model)
 
 
 LABEL_RE = re.compile(r'^\s*("?)(?P<label>non-?\s*record|record)\b', re.IGNORECASE)
@@ -150,42 +271,190 @@ def parse_label(generated: str) -> str:
     return "Non-Record"
 
 
-def classify_records(statements, batch_size=BATCH_SIZE):
-    
-    results = []
-    for i in tqdm(range(0, len(statements), batch_size), desc="Classifying Records"):
-        batch = statements[i:i + batch_size]
-        
-        prompts = [build_prompt(stmt) for stmt in batch]
-
-        inputs = tokenizer(
-            prompts,
-            return_tensors="pt",
-            padding=True,
-            truncation=True,
-            max_length=4096
-        ).to(model.device)
-
-        with torch.no_grad():
-            outputs = model.generate(
-                **inputs,
-                max_new_tokens=50,
-                do_sample=False,
-                pad_token_id=tokenizer.eos_token_id,
-                eos_token_id=tokenizer.eos_token_id
-            )
-
-        for j, output in enumerate(outputs):
-            input_length = inputs.input_ids[j].shape[0]
-            generated_text = tokenizer.decode(output[input_length:], skip_special_tokens=True)
-            label = parse_label(generated_text)
-            results.append(label)
-
-        torch.cuda.empty_cache()
+PACKED_LINE_RE = re.compile(r'^\s*(?P<statement>".*")\s*->\s*(?P<label>.*)$')
+
+
+def parse_packed_output(generated, statements):
+    """Map `"<statement>" -> Label` lines back onto `statements`.
+
+    Lines are matched by their quoted statement, not their position; statements without a clean line
+    (missing, garbled, or an unrecognised label) come back as None.
+    """
+
+    labels = [None] * len(statements)
+    positions = {}
+    for i, stmt in enumerate(statements):
+        positions.setdefault(stmt, []).append(i)
+
+    for line in generated.splitlines():
+        m = PACKED_LINE_RE.match(line)
+        if not m or not LABEL_RE.search(m.group("label")):
+            continue
+        try:
+            stmt = json.loads(m.group("statement"))
+        except json.JSONDecodeError:
+            continue
+        free = [i for i in positions.get(stmt, []) if labels[i] is None]
+        if free:
+            labels[free[0]] = parse_label(m.group("label"))
+
+    return labels
+
+
+def pack_examples(nearest, k):
+    """Up to k examples for one pack, taking each statement's nearest in turn so every statement gets its closest first."""
+    chosen = []
+    for rank in range(max((len(n) for n in nearest), default=0)):
+        for examples in nearest:
+            if rank < len(examples) and examples[rank] not in chosen:
+                chosen.append(examples[rank])
+    return chosen[:k]
+
+
+def classify_packed(statements, pack_size, batch_size=BATCH_SIZE, progress=True, reuse_prefix=False, few_shot_k=None,
+                    few_shot_human=False):
+    """Classify `pack_size` statements per prompt, re-asking individually for any the reply did not cover.
+
+    With few_shot_k, each pack's prompt carries the k examples nearest to its statements (see pack_examples).
+    """
+
+    tokenizer, model = get_model("classify_records")
+
+    packs = [statements[i:i + pack_size] for i in range(0, len(statements), pack_size)]
+    if few_shot_k:
+        nearest = get_example_index(few_shot_human).nearest(statements, few_shot_k)
+        suffixes = [build_examples(pack_examples(nearest[i:i + pack_size], few_shot_k)[::-1]) + build_packed_suffix(pack)
+                    for i, pack in zip(range(0, len(statements), pack_size), packs)]
+        shared = build_system_prefix()
+    else:
+        suffixes = [build_packed_suffix(pack) for pack in packs]
+        shared = build_prefix()
+    prefix = get_prefix_cache(tokenizer, model, shared) if reuse_prefix else None
+    prompts = suffixes if prefix else [shared + suffix for suffix in suffixes]
+
+    # Room for every statement echoed back plus its label.
+    max_new_tokens = max(
+        sum(len(tokenizer(json.dumps(s), add_special_tokens=False).input_ids) + 8 for s in pack) for pack in packs
+    ) if packs else 0
+
+    generated_texts = generate(
+        MODEL, tokenizer, model, prompts,
+        batch_size=batch_size,
+        max_new_tokens=max_new_tokens,
+        desc="Classifying Records (packed)",
+        progress=progress,
+        prefix=prefix,
+        do_sample=False,
+        eos_token_id=tokenizer.eos_token_id
+    )
+
+    labels = []
+    for pack, text in zip(packs, generated_texts):
+        labels.extend(parse_packed_output(text, pack))
 
+    missing = [i for i, label in enumerate(labels) if label is None]
+    if missing:
+        print(f"Re-asking {len(missing)} of {len(statements)} statements individually")
+        retried = classify_records([statements[i] for i in missing], batch_size=batch_size, progress=False, reuse_prefix=reuse_prefix,
+                                   few_shot_k=few_shot_k, few_shot_human=few_shot_human)
+        for i, label in zip(missing, retried):
+            labels[i] = label
+
+    return labels
+
+
+def score_records(statements, batch_size=BATCH_SIZE, progress=True, reuse_prefix=False, few_shot_k=None, few_shot_human=False):
+    """Label each statement from one forward pass instead of a decode.
+
+    Compares the next-token log-probabilities of the "Record" and "Non-Record" continuations and returns
+    (label, margin) pairs, where margin is how many nats the chosen label leads by.
+    """
+
+    tokenizer, model = get_model("classify_records")
+
+    labels = list(RECORD_CONTINUATIONS)
+    token_ids = continuation_token_ids(tokenizer, list(RECORD_CONTINUATIONS.values()))
+    prompts, prefix = record_prompts(tokenizer, model, statements, reuse_prefix, few_shot_k, few_shot_human)
+    scores = score_continuations(
+        tokenizer, model, prompts, token_ids,
+        batch_size=batch_size,
+        max_length=4096,
+        desc="Scoring Records",
+        progress=progress,
+        prefix=prefix
+    )
+
+    results = []
+    for record_lp, non_record_lp in scores:
+        label = labels[0] if record_lp > non_record_lp else labels[1]
+        results.append((label, abs(record_lp - non_record_lp)))
     return results
 
 
+def cascade_records(statements, batch_size=BATCH_SIZE, progress=True, reuse_prefix=False, pack_size=None, thresholds=None,
+                    few_shot_k=None, few_shot_human=False):
+    """Label confident statements from their embeddings and send only the uncertain ones to the LLM."""
+
+    cascade = get_record_cascade(thresholds)
+    labels = cascade.decide(statements)
+
+    escalated = [i for i, label in enumerate(labels) if label is None]
+    if progress:
+        print(f"Record cascade escalated {len(escalated)} of {len(statements)} statements to the LLM")
+    if escalated:
+        llm_labels = classify_records([statements[i] for i in escalated], batch_size=batch_size, progress=progress,
+                                      reuse_prefix=reuse_prefix, pack_size=pack_size, few_shot_k=few_shot_k,
+                                      few_shot_human=few_shot_human)
+        for i, label in zip(escalated, llm_labels):
+            labels[i] = label
+
+    return labels
+
+
+def classify_records(statements, batch_size=BATCH_SIZE, progress=True, mode="generate", reuse_prefix=False, pack_size=None,
+                     thresholds=None, few_shot_k=None, few_shot_human=False):
+    """Label statements "Record"/"Non-Record".
+
+    mode="score" reads the label off one forward pass (see score_records). With reuse_prefix, the shared
+    system prompt and few-shot examples are encoded once and their key/value cache reused for every batch.
+    With pack_size > 1, each generated prompt carries that many statements (see classify_packed).
+    mode="cascade" puts the embedding classifier from cascade.py in front of the generate mode; `thresholds`
+    is its (non_record_below, record_above) pair. With few_shot_k, prompts carry the k most similar labelled
+    examples instead of all of examples_data (see record_prompts); few_shot_human adds the human-labelled CSV
+    to the examples searched.
+    """
+    
+    if mode == "cascade":
+        return cascade_records(statements, batch_size=batch_size, progress=progress, reuse_prefix=reuse_prefix,
+                               pack_size=pack_size, thresholds=thresholds, few_shot_k=few_shot_k,
+                               few_shot_human=few_shot_human)
+    if mode == "generate" and pack_size and pack_size > 1:
+        return classify_packed(statements, pack_size, batch_size=batch_size, progress=progress, reuse_prefix=reuse_prefix,
+                               few_shot_k=few_shot_k, few_shot_human=few_shot_human)
+    if mode == "score":
+        return [label for label, _ in score_records(statements, batch_size=batch_size, progress=progress, reuse_prefix=reuse_prefix,
+                                                     few_shot_k=few_shot_k, few_shot_human=few_shot_human)]
+    if mode != "generate":
+        raise ValueError(f"Unknown classify_records mode '{mode}'")
+
+    tokenizer, model = get_model("classify_records")
+
+    prompts, prefix = record_prompts(tokenizer, model, statements, reuse_prefix, few_shot_k, few_shot_human)
+    generated_texts = generate(
+        MODEL, tokenizer, model, prompts,
+        batch_size=batch_size,
+        max_new_tokens=50,
+        max_length=4096,
+        desc="Classifying Records",
+        progress=progress,
+        prefix=prefix,
+        do_sample=False,
+        eos_token_id=tokenizer.eos_token_id
+    )
+
+    return [parse_label(text) for text in generated_texts]
+
+
 def load_statements(input_data):
     if isinstance(input_data, list):
         statements = [str(s) for s in input_data if pd.notna(s)]
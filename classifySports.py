@@ -3,7 +3,10 @@ import pandas as pd
 import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
 import gc
-from tqdm import tqdm
+
+from models import register_model, get_model
+from generation import generate, score_continuations
+from cascade import get_sport_knn
 
 
 MODEL = '/scratch/nitishk_iitp/models/llama-3.1-8B'
@@ -11,30 +14,38 @@ BATCH_SIZE = 20
 
 valid_sports = ['cricket', 'basketball', 'baseball', 'soccer']
 
+# In scoring mode, the best sport is reported as "unknown" when its probability falls below this.
+UNKNOWN_THRESHOLD = 0.5
+
+
+def load_model():
+    tokenizer = AutoTokenizer.from_pretrained(
+        MODEL,
+        padding_side='left',
+        trust_remote_code=True,
+        local_files_only=True
+    )
+    tokenizer.pad_token = tokenizer.eos_token
 
-tokenizer = AutoTokenizer.from_pretrained(
-    MODEL,
-    padding_side='left',
-    trust_remote_code=True,
-    local_files_only=True
-)
-tokenizer.pad_token = tokenizer.eos_token
+    quant_config = BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_compute_dtype=torch.float16,
+        bnb_4bit_use_double_quant=True,
+    )
 
-quant_config = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_quant_type="nf4",
-    bnb_4bit_compute_dtype=torch.float16,
-    bnb_4bit_use_double_quant=True,
-)
+    model = AutoModelForCausalLM.from_pretrained(
+        MODEL,
+        quantization_config=quant_config if torch.cuda.is_available() else None,
+        device_map="auto",
+        dtype=torch.float16,
+        trust_remote_code=True,
+        local_files_only=True
+    )
+    return tokenizer, model
 
-model = AutoModelForCausalLM.from_pretrained(
-    MODEL,
-    quantization_config=quant_config,
-    device_map="auto",
-    dtype=torch.float16,
-    trust_remote_code=True,
-    local_files_only=True
-)
+
+register_model("classify_sports", load_model)
 
 
 def create_prompt(statement):
@@ -57,57 +68,132 @@ def validate_classification(output):
     return "unknown"
 
 
-def classify_sports(statements, batch_size=BATCH_SIZE):
+def build_chat_prompts(tokenizer, statements):
+    chat_prompts = []
+    for s in statements:
+        user_message = create_prompt(s)
+        messages = [{"role": "user", "content": user_message}]
+        formatted_prompt = tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=True
+        )
+        chat_prompts.append(formatted_prompt)
+    return chat_prompts
+
+
+def sport_token_ids(tokenizer):
+    """First tokens that can open each sport's answer, dropping any token shared between sports."""
+
+    candidates = {}
+    for sport in valid_sports:
+        variants = [sport, sport.capitalize(), " " + sport, " " + sport.capitalize()]
+        candidates[sport] = {tokenizer.encode(v, add_special_tokens=False)[0] for v in variants}
+
+    token_ids = {}
+    for sport, ids in candidates.items():
+        shared = set().union(*(other for name, other in candidates.items() if name != sport))
+        token_ids[sport] = sorted(ids - shared)
+        if not token_ids[sport]:
+            raise ValueError(f"No token distinguishes '{sport}' from the other sports")
+    return token_ids
+
+
+def sport_probs(row, token_ids):
+    """Per-sport probabilities from log-probabilities laid out as in sport_token_ids order, renormalised over the sports."""
+
+    sport_scores, start = [], 0
+    for sport in valid_sports:
+        n = len(token_ids[sport])
+        sport_scores.append(torch.logsumexp(torch.tensor(row[start:start + n]), dim=0))
+        start += n
+    return dict(zip(valid_sports, torch.softmax(torch.stack(sport_scores), dim=0).tolist()))
+
+
+def best_sport(probs, threshold=UNKNOWN_THRESHOLD):
+    sport = max(probs, key=probs.get)
+    return sport if probs[sport] >= threshold else "unknown"
+
+
+def score_sports(statements, batch_size=BATCH_SIZE, progress=True, threshold=UNKNOWN_THRESHOLD):
+    """Classify from a single forward pass by scoring only the four valid sport continuations.
+
+    Each result carries per-sport probabilities (renormalised over the four sports); the best sport is
+    replaced by "unknown" when its probability is below `threshold`.
+    """
+
+    tokenizer, model = get_model("classify_sports")
+
+    token_ids = sport_token_ids(tokenizer)
+    flat_ids = [i for sport in valid_sports for i in token_ids[sport]]
+    scores = score_continuations(
+        tokenizer, model, build_chat_prompts(tokenizer, statements), flat_ids,
+        batch_size=batch_size,
+        max_length=2048,
+        desc="Scoring Sports",
+        progress=progress
+    )
+
     results = []
-    
-    for i in tqdm(range(0, len(statements), batch_size), desc="Classifying"):
-        batch_statements = statements[i:i + batch_size]
-       
-        chat_prompts = []
-        for s in batch_statements:
-            user_message = create_prompt(s)
-            messages = [{"role": "user", "content": user_message}]
-            formatted_prompt = tokenizer.apply_chat_template(
-                messages,
-                tokenize=False,
-                add_generation_prompt=True
-            )
-            chat_prompts.append(formatted_prompt)
-        
-        inputs = tokenizer(
-            chat_prompts,
-            return_tensors="pt",
-            truncation=True,
-            max_length=2048,
-            padding=True
-        ).to(model.device)
-    
-        with torch.no_grad():
-            outputs = model.generate(
-                **inputs,
-                max_new_tokens=50,
-                temperature=0.1,
-                top_p=0.9,
-                do_sample=False,
-                pad_token_id=tokenizer.eos_token_id
-            )
-        
-        for j, output_seq in enumerate(outputs):
-            input_length = inputs.input_ids[j].shape[0]
-            generated_text = tokenizer.decode(
-                output_seq[input_length:],
-                skip_special_tokens=True
-            ).strip().lower()
-            
-            classification = validate_classification(generated_text)
-            results.append({
-                "statement": batch_statements[j],
-                "sport": classification,
-            })
-        
-        del inputs, outputs
-        torch.cuda.empty_cache()
-        gc.collect()
+    for stmt, row in zip(statements, scores):
+        probs = sport_probs(row, token_ids)
+        results.append({
+            "statement": stmt,
+            "sport": best_sport(probs, threshold),
+            "probs": probs,
+        })
+
+    return results
+
+
+def knn_sports(statements, batch_size=BATCH_SIZE, progress=True):
+    """Answer from the labelled-statement kNN index where the neighbours agree; ask the LLM otherwise."""
+
+    sports = get_sport_knn().decide(statements)
+
+    escalated = [i for i, sport in enumerate(sports) if sport is None]
+    if progress:
+        print(f"Sport kNN escalated {len(escalated)} of {len(statements)} statements to the LLM")
+    if escalated:
+        llm_results = classify_sports([statements[i] for i in escalated], batch_size=batch_size, progress=progress)
+        for i, result in zip(escalated, llm_results):
+            sports[i] = result["sport"]
+
+    return [{"statement": stmt, "sport": sport} for stmt, sport in zip(statements, sports)]
+
+
+def classify_sports(statements, batch_size=BATCH_SIZE, progress=True, mode="generate"):
+    if mode == "knn":
+        return knn_sports(statements, batch_size=batch_size, progress=progress)
+    if mode == "score":
+        return score_sports(statements, batch_size=batch_size, progress=progress)
+    if mode != "generate":
+        raise ValueError(f"Unknown classify_sports mode '{mode}'")
+
+    tokenizer, model = get_model("classify_sports")
+    chat_prompts = build_chat_prompts(tokenizer, statements)
+
+    generated_texts = generate(
+        MODEL, tokenizer, model, chat_prompts,
+        batch_size=batch_size,
+        max_new_tokens=50,
+        max_length=2048,
+        desc="Classifying",
+        progress=progress,
+        temperature=0.1,
+        top_p=0.9,
+        do_sample=False
+    )
+
+    results = []
+    for stmt, generated_text in zip(statements, generated_texts):
+        classification = validate_classification(generated_text.strip().lower())
+        results.append({
+            "statement": stmt,
+            "sport": classification,
+        })
+
+    gc.collect()
     
     return results
 
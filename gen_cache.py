@@ -0,0 +1,72 @@
+import json
+import time
+import hashlib
+import sqlite3
+
+
+class GenerationCache:
+    """On-disk cache of LLM generations keyed by model id, exact prompt and decoding parameters.
+
+    Only deterministic (greedy) generations should be stored; entries beyond `max_entries` are
+    evicted least-recently-used first.
+    """
+
+    def __init__(self, path="generation_cache.db", max_entries=500_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.con = sqlite3.connect(path)
+        self.con.execute("""CREATE TABLE IF NOT EXISTS generations (
+            key TEXT PRIMARY KEY, model TEXT, value TEXT, last_used REAL
+        )""")
+        self.con.execute("CREATE INDEX IF NOT EXISTS generations_last_used ON generations (last_used)")
+        self.con.commit()
+
+    @staticmethod
+    def make_key(model_id, prompt, params):
+        payload = json.dumps([model_id, prompt, sorted(params.items())], default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        found = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self.con.execute(
+                f"SELECT key, value FROM generations WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            found.update((k, json.loads(v)) for k, v in rows)
+
+        if found:
+            now = time.time()
+            self.con.executemany("UPDATE generations SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+            self.con.commit()
+
+        self.hits += sum(1 for k in keys if k in found)
+        self.misses += sum(1 for k in keys if k not in found)
+        return found
+
+    def put_many(self, model_id, entries):
+        now = time.time()
+        self.con.executemany(
+            "INSERT OR REPLACE INTO generations (key, model, value, last_used) VALUES (?, ?, ?, ?)",
+            [(key, model_id, json.dumps(value), now) for key, value in entries]
+        )
+        self._evict()
+        self.con.commit()
+
+    def _evict(self):
+        count = self.con.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+        if count > self.max_entries:
+            self.con.execute(
+                "DELETE FROM generations WHERE key IN (SELECT key FROM generations ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        print(f"Generation cache: {self.hits} hits, {self.misses} misses ({rate:.1%} hit rate)")
+
+    def close(self):
+        self.con.close()
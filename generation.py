@@ -0,0 +1,384 @@
+import copy
+import time
+import weakref
+from contextlib import contextmanager, nullcontext
+
+import torch
+from tqdm import tqdm
+from transformers import StoppingCriteriaList, StopStringCriteria
+
+from gen_cache import GenerationCache
+from tracing import trace_span
+
+
+# Length bucketing only reorders prompts within one generate() call, so callers that chunk their input
+# (checkpointed stages, streaming) hand it this many generation batches at a time.
+BUCKET_BATCHES = 8
+
+_cache = None
+
+padding_stats = {"prompt_tokens": 0, "padded_tokens": 0, "input_order_padded_tokens": 0}
+token_stats = {"generate_calls": 0, "generated_tokens": 0}
+speculative_stats = {"target_forwards": 0, "draft_forwards": 0, "generated_tokens": 0, "seconds": 0.0}
+# Per stop label (a SportsProcessor stage, or the stop sequences themselves): sequences generated, how many ended at a stop sequence,
+# tokens generated, and max_new_tokens budget left unused by sequences and by whole batches.
+stop_stats = {}
+
+
+def set_generation_cache(cache):
+    global _cache
+    _cache = cache
+
+
+def get_generation_cache():
+    return _cache
+
+
+def stats_snapshot():
+    """Copy of the running padding and token counters; diff two snapshots to attribute work to a span."""
+    return dict(padding_stats, **token_stats)
+
+
+def _padded_size(lengths, batch_size):
+    return sum(max(lengths[i:i + batch_size]) * len(lengths[i:i + batch_size]) for i in range(0, len(lengths), batch_size))
+
+
+def length_buckets(lengths, batch_size):
+    """Split indices into batches of similar length, longest first, so batches pad as little as possible."""
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def speculative_report():
+    """Draft acceptance rate and tokens/sec of assisted generation so far.
+
+    Every target forward verifies one block of draft tokens and emits the accepted ones plus one of its
+    own, so accepted = generated - target forwards; each draft forward proposes one token.
+    """
+    s = speculative_stats
+    accepted = s["generated_tokens"] - s["target_forwards"]
+    rate = accepted / s["draft_forwards"] if s["draft_forwards"] else 0.0
+    tokens_per_sec = s["generated_tokens"] / s["seconds"] if s["seconds"] else 0.0
+    print(f"Speculative decoding: {rate:.1%} of {s['draft_forwards']} draft tokens accepted, "
+          f"{s['generated_tokens'] / max(s['target_forwards'], 1):.2f} tokens per target forward, {tokens_per_sec:.1f} tokens/sec")
+    return dict(s, acceptance_rate=rate, tokens_per_sec=tokens_per_sec)
+
+
+@contextmanager
+def _speculative_counters(model, assistant_model):
+    """Count target and draft forward passes (and time) for the duration of one assisted generate call."""
+
+    def counter(key):
+        def hook(module, args, output):
+            speculative_stats[key] += 1
+        return hook
+
+    hooks = [model.register_forward_hook(counter("target_forwards")),
+             assistant_model.register_forward_hook(counter("draft_forwards"))]
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        speculative_stats["seconds"] += time.perf_counter() - start
+        for hook in hooks:
+            hook.remove()
+
+
+def padding_report():
+    saved = padding_stats["input_order_padded_tokens"] - padding_stats["padded_tokens"]
+    before = padding_stats["input_order_padded_tokens"] - padding_stats["prompt_tokens"]
+    after = padding_stats["padded_tokens"] - padding_stats["prompt_tokens"]
+    print(f"Padding: {after} pad tokens with length bucketing vs {before} in input order ({saved} saved)")
+    return dict(padding_stats, saved_tokens=saved)
+
+
+def stop_report():
+    """Print and return, per stop label, the tokens and decode steps saved against max_new_tokens."""
+
+    if not stop_stats:
+        return {}
+    print(f"\n{'Stop at':<18}{'Seqs':>7}{'Stopped':>9}{'Gen tok':>9}{'Tok saved':>11}{'Batches':>9}{'Steps saved':>13}")
+    for label, s in stop_stats.items():
+        print(f"{label:<18}{s['sequences']:>7}{s['stopped']:>9}{s['generated_tokens']:>9}{s['tokens_saved']:>11}"
+              f"{s['batches']:>9}{s['steps_saved']:>13}")
+    return stop_stats
+
+
+def _truncate_at_stop(text, stop_strings):
+    """Cut `text` after the earliest stop sequence; assisted generation can accept tokens past one."""
+    ends = [text.find(stop) + len(stop) for stop in stop_strings if stop in text]
+    return text[:min(ends)] if ends else text
+
+
+def _record_stop(label, stop_strings, max_new_tokens, steps, finished):
+    """`finished` holds (text, new_tokens) for each sequence of one batch that decoded `steps` tokens."""
+
+    stats = stop_stats.setdefault(label or ",".join(stop_strings), {
+        "sequences": 0, "stopped": 0, "generated_tokens": 0, "tokens_saved": 0, "batches": 0, "steps_saved": 0
+    })
+    stats["batches"] += 1
+    stats["steps_saved"] += max_new_tokens - steps
+    for text, new_tokens in finished:
+        stats["sequences"] += 1
+        stats["generated_tokens"] += new_tokens
+        if text.rstrip().endswith(tuple(stop_strings)):
+            stats["stopped"] += 1
+            stats["tokens_saved"] += max_new_tokens - new_tokens
+
+
+class PrefixCache:
+    """Key/value cache for a prompt prefix that every prompt of a run starts with, computed once.
+
+    Prompts passed alongside a PrefixCache are only the suffixes; each batch reuses a copy of the
+    prefix's keys and values, so prefill costs just the suffix tokens. Only a weak reference to the
+    model is kept, so a cache never keeps an unloaded model alive.
+    """
+
+    def __init__(self, tokenizer, model, prefix):
+        self.prefix = prefix
+        self._model = weakref.ref(model)
+        self.input_ids = tokenizer(prefix, return_tensors="pt").input_ids.to(model.device)
+        self.length = self.input_ids.shape[1]
+        with torch.no_grad():
+            self.past_key_values = model(input_ids=self.input_ids, use_cache=True).past_key_values
+
+    @property
+    def model(self):
+        return self._model()
+
+    def expand(self, batch_size):
+        past_key_values = copy.deepcopy(self.past_key_values)
+        past_key_values.batch_repeat_interleave(batch_size)
+        return past_key_values
+
+    def batch_inputs(self, suffix_inputs):
+        """Prefix + left-padded suffix ids and the matching mask; pads sit between prefix and suffix."""
+        batch_size = suffix_inputs.input_ids.shape[0]
+        input_ids = torch.cat([self.input_ids.expand(batch_size, -1), suffix_inputs.input_ids], dim=1)
+        attention_mask = torch.cat([
+            torch.ones(batch_size, self.length, dtype=suffix_inputs.attention_mask.dtype, device=self.input_ids.device),
+            suffix_inputs.attention_mask
+        ], dim=1)
+        return input_ids, attention_mask
+
+
+def _encode_buckets(tokenizer, prompts, batch_size, max_length=None, prefix=None):
+    if prefix is not None:
+        encoded = tokenizer(prompts, add_special_tokens=False)["input_ids"]
+        if max_length:
+            encoded = [ids[-(max_length - prefix.length):] for ids in encoded]
+    else:
+        tokenizer_kwargs = {"max_length": max_length} if max_length else {}
+        encoded = tokenizer(prompts, truncation=True, **tokenizer_kwargs)["input_ids"]
+    lengths = [len(ids) for ids in encoded]
+    buckets = length_buckets(lengths, batch_size)
+
+    padding_stats["prompt_tokens"] += sum(lengths)
+    padding_stats["padded_tokens"] += sum(max(lengths[k] for k in b) * len(b) for b in buckets)
+    padding_stats["input_order_padded_tokens"] += _padded_size(lengths, batch_size)
+    return encoded, buckets
+
+
+def _generated_length(ids, pad_token_id):
+    ids = ids.tolist()
+    return ids.index(pad_token_id) if pad_token_id in ids else len(ids)
+
+
+def generate(model_id, tokenizer, model, prompts, batch_size, max_new_tokens, max_length=None,
+             desc=None, progress=False, decode_kwargs=None, prefix=None, assistant=None, stop_strings=None,
+             stop_label=None, return_lengths=False, **decoding):
+    """Run `model.generate` over already-formatted prompts in batches and return the decoded continuations.
+
+    Greedy generations (do_sample=False) are looked up in, and written to, the active generation cache,
+    so only prompts that were never generated before reach the model. The rest are batched by token
+    length rather than input order to cut padding; outputs always come back in input order.
+    With a PrefixCache, `prompts` are suffixes of `prefix.prefix` and the prefix is never re-encoded.
+    With `assistant` = (tokenizer, model), a small draft model proposes tokens for the target to verify
+    (assisted generation); transformers only supports that one prompt at a time.
+    With `stop_strings`, a sequence finishes once it has generated any of them (kept in the output) and a
+    batch ends as soon as all of its sequences have; the savings are tallied in stop_stats under `stop_label`.
+    With `return_lengths`, returns (texts, generated token counts) instead of just the texts.
+    """
+
+    params = dict(decoding, max_new_tokens=max_new_tokens, max_length=max_length)
+    if stop_strings:
+        params["stop_strings"] = list(stop_strings)
+    cache = _cache if not decoding.get("do_sample", False) else None
+    prefix_text = prefix.prefix if prefix is not None else ""
+
+    texts = [None] * len(prompts)
+    lengths = [None] * len(prompts)
+    keys = [GenerationCache.make_key(model_id, prefix_text + p, params) for p in prompts] if cache else []
+    if cache:
+        found = cache.get_many(keys)
+        for i, key in enumerate(keys):
+            if key in found:
+                texts[i] = found[key]["text"]
+                lengths[i] = found[key]["new_tokens"]
+
+    pending = [i for i, t in enumerate(texts) if t is None]
+    if not pending:
+        return (texts, lengths) if return_lengths else texts
+
+    extra = {}
+    if stop_strings:
+        # As a stopping criterion rather than `stop_strings`, which assisted generation would also hand to the draft.
+        extra["stopping_criteria"] = StoppingCriteriaList([StopStringCriteria(tokenizer, list(stop_strings))])
+    if assistant is not None:
+        batch_size = 1
+        assistant_tokenizer, assistant_model = assistant
+        extra["assistant_model"] = assistant_model
+        if model.config.get_text_config().vocab_size != assistant_model.config.get_text_config().vocab_size:
+            extra.update(tokenizer=tokenizer, assistant_tokenizer=assistant_tokenizer)
+
+    encoded, buckets = _encode_buckets(tokenizer, [prompts[i] for i in pending], batch_size, max_length, prefix)
+
+    for bucket in tqdm(buckets, desc=desc, disable=not progress):
+        idxs = [pending[k] for k in bucket]
+
+        inputs = tokenizer.pad(
+            {"input_ids": [encoded[k] for k in bucket]},
+            padding=True,
+            return_tensors="pt"
+        ).to(model.device)
+
+        model_inputs = dict(inputs)
+        if prefix is not None:
+            input_ids, attention_mask = prefix.batch_inputs(inputs)
+            model_inputs = {
+                "input_ids": input_ids,
+                "attention_mask": attention_mask,
+                "past_key_values": prefix.expand(len(bucket))
+            }
+
+        with torch.no_grad(), trace_span("generate", "generate", model=model_id, prompt_count=len(idxs),
+                                         prompt_tokens=sum(len(encoded[k]) for k in bucket)):
+            counters = _speculative_counters(model, assistant[1]) if assistant is not None else nullcontext()
+            with counters:
+                outputs = model.generate(
+                    **model_inputs,
+                    max_new_tokens=max_new_tokens,
+                    pad_token_id=tokenizer.eos_token_id,
+                    **extra,
+                    **decoding
+                )
+
+        input_length = model_inputs["input_ids"].shape[1]
+        token_stats["generate_calls"] += 1
+        entries = []
+        finished = []
+        for j, i in enumerate(idxs):
+            generated = outputs[j][input_length:]
+            new_tokens = _generated_length(generated, tokenizer.eos_token_id)
+            token_stats["generated_tokens"] += new_tokens
+            lengths[i] = new_tokens
+            if assistant is not None:
+                speculative_stats["generated_tokens"] += new_tokens
+            texts[i] = tokenizer.decode(generated, skip_special_tokens=True, **(decode_kwargs or {}))
+            if stop_strings:
+                texts[i] = _truncate_at_stop(texts[i], stop_strings)
+            finished.append((texts[i], new_tokens))
+            if cache:
+                entries.append((keys[i], {
+                    "text": texts[i],
+                    "new_tokens": new_tokens
+                }))
+
+        if stop_strings:
+            _record_stop(stop_label, stop_strings, max_new_tokens, outputs.shape[1] - input_length, finished)
+        if cache:
+            cache.put_many(model_id, entries)
+
+        del inputs, model_inputs, outputs
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    return (texts, lengths) if return_lengths else texts
+
+
+def continuation_token_ids(tokenizer, continuations):
+    """First token of each continuation; they must differ for one next-token distribution to tell them apart."""
+    ids = [tokenizer.encode(c, add_special_tokens=False)[0] for c in continuations]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"Continuations {continuations} do not start with distinct tokens")
+    return ids
+
+
+def next_token_logprobs(model, input_ids, attention_mask, prefix=None, positions=1):
+    """Log-probabilities of the token following each left-padded row, from one forward pass.
+
+    Only the last `positions` positions go through the LM head, so the full (batch, seq, vocab) logits are
+    never built; with positions > 1 the result is (batch, positions, vocab), last position last.
+    With a PrefixCache, `input_ids` are suffixes and `attention_mask` covers prefix and suffix.
+    """
+    position_ids = (attention_mask.long().cumsum(-1) - 1).clamp(min=0)
+    past_key_values = None
+    if prefix is not None:
+        position_ids = position_ids[:, prefix.length:]
+        past_key_values = prefix.expand(input_ids.shape[0])
+
+    hidden = model.base_model(
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        position_ids=position_ids,
+        past_key_values=past_key_values,
+        use_cache=prefix is not None
+    ).last_hidden_state[:, -positions:]
+    logits = model.get_output_embeddings()(hidden).float()
+    logprobs = torch.log_softmax(logits, dim=-1)
+    return logprobs[:, -1] if positions == 1 else logprobs
+
+
+def score_positions(tokenizer, model, prompts, token_ids_by_offset, batch_size, max_length=None, desc=None,
+                    progress=False, prefix=None):
+    """Log-probabilities of chosen tokens at several positions near the end of each prompt, in one forward pass.
+
+    `token_ids_by_offset` maps an offset from the end (1 = the token after the prompt, 2 = the prompt's
+    last token, ...) to the ids to read there; each result is {offset: [log-probabilities]}, in input order.
+    """
+
+    scores = [None] * len(prompts)
+    if not prompts:
+        return scores
+
+    encoded, buckets = _encode_buckets(tokenizer, prompts, batch_size, max_length, prefix)
+    positions = max(token_ids_by_offset)
+    token_ids = {offset: torch.tensor(ids) for offset, ids in token_ids_by_offset.items()}
+
+    for bucket in tqdm(buckets, desc=desc, disable=not progress):
+        inputs = tokenizer.pad(
+            {"input_ids": [encoded[k] for k in bucket]},
+            padding=True,
+            return_tensors="pt"
+        ).to(model.device)
+
+        attention_mask = inputs.attention_mask
+        if prefix is not None:
+            _, attention_mask = prefix.batch_inputs(inputs)
+
+        with torch.no_grad(), trace_span("score", "generate", prompt_count=len(bucket),
+                                         prompt_tokens=sum(len(encoded[k]) for k in bucket)):
+            logprobs = next_token_logprobs(model, inputs.input_ids, attention_mask, prefix, positions=positions)
+        if positions == 1:
+            logprobs = logprobs.unsqueeze(1)
+
+        for j, k in enumerate(bucket):
+            scores[k] = {
+                offset: logprobs[j, positions - offset, ids.to(logprobs.device)].tolist()
+                for offset, ids in token_ids.items()
+            }
+
+        del inputs, logprobs
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    return scores
+
+
+def score_continuations(tokenizer, model, prompts, token_ids, batch_size, max_length=None, desc=None, progress=False,
+                        prefix=None):
+    """Next-token log-probability of every id in `token_ids` after each prompt, in input order."""
+
+    scores = score_positions(tokenizer, model, prompts, {1: token_ids}, batch_size, max_length=max_length, desc=desc,
+                             progress=progress, prefix=prefix)
+    return [row[1] if row is not None else None for row in scores]
@@ -1,81 +1,382 @@
 import os
 import json
 import pandas as pd
+from collections import OrderedDict
+from tqdm import tqdm
 
-from utils import load_statements
+from utils import (
+    load_statements, iter_statements, load_labelled_statements, iter_labelled_statements,
+    batched, append_jsonl, dedupe_statements, statement_key
+)
 from classifyRecords import classify_records
 from classifySports import classify_sports
-from sports import SportsProcessor
+from classifyFused import classify_fused
+from sports import SportsProcessor, MAX_NEW_TOKENS, entity_report
+from models import ModelResidency, set_residency
+from checkpoint import StageCheckpoint, run_stage
+from gen_cache import GenerationCache
+from budgets import GenerationBudgets, set_generation_budgets
+from generation import BUCKET_BATCHES, set_generation_cache, get_generation_cache, padding_report, speculative_report, stop_report
+from cascade import record_cascade_report, sport_knn_report
+from tracing import TraceRecorder, set_tracer, trace_span, add_span_hook, remove_span_hook
+from memory import MemoryMonitor
 
 
 UNIFIED_BATCH_SIZE = 5
+# Results of the most recently seen unique statements kept for reuse by later batches of a stream.
+STREAM_DEDUPE_ENTRIES = 10_000
+SUPPORTED_SPORTS = ["baseball", "basketball", "cricket", "soccer"]
+PIPELINE_STAGES = ["records", "sports", "sql"]
+# Longest prompt plus generation budget a SQL-stage sequence is sized for when scaling batches.
+SQL_STAGE_SEQ_LEN = 4096 + MAX_NEW_TOKENS
+DEFAULT_MODES = {"record": "generate", "sport": "generate", "record_prefix_cache": False, "record_pack_size": None,
+                 "record_thresholds": None, "fused": False,
+                 "record_few_shot_k": None, "record_few_shot_human": False,
+                 "profile": False, "speculative": False, "entity_thresholds": None}
 
 
-def run_pipeline(input_data, output_path="Results.json"):
-    
-    all_statements = load_statements(input_data)
-    if not all_statements:
-        print("No valid statements found.")
-        return
+def label_scope(mode, **options):
+    """Checkpoint scope for a classifier: its mode plus every label-affecting option that is set."""
+    return ",".join([mode] + [f"{name}={value}" for name, value in sorted(options.items()) if value not in (None, False)])
 
-    record_labels = classify_records(all_statements, batch_size=UNIFIED_BATCH_SIZE)
 
-    record_statements = [
-        stmt for stmt, label in zip(all_statements, record_labels) if label == "Record"
-    ]
-    non_record_count = len(all_statements) - len(record_statements)
-    print(f"Found {len(record_statements)} Record statements. Skipped {non_record_count} Non-Record.")
+def label_records(statements, batch_size=UNIFIED_BATCH_SIZE, checkpoint=None, progress=True, mode="generate", reuse_prefix=False,
+                  pack_size=None, thresholds=None, few_shot_k=None, few_shot_human=False):
+    return run_stage(
+        checkpoint, "record", statements, statements,
+        lambda chunk: classify_records(chunk, batch_size=batch_size, progress=progress and checkpoint is None, mode=mode,
+                                       reuse_prefix=reuse_prefix, pack_size=pack_size, thresholds=thresholds,
+                                       few_shot_k=few_shot_k, few_shot_human=few_shot_human),
+        batch_size, progress=progress,
+        scope=label_scope(mode, reuse_prefix=reuse_prefix, pack_size=pack_size, thresholds=thresholds,
+                          few_shot_k=few_shot_k, few_shot_human=few_shot_human)
+    )
+
+
+def label_sports(statements, batch_size=UNIFIED_BATCH_SIZE, checkpoint=None, progress=True, mode="generate"):
+    sports = run_stage(
+        checkpoint, "sport", statements, statements,
+        lambda chunk: [r["sport"] for r in classify_sports(chunk, batch_size=batch_size, progress=progress and checkpoint is None, mode=mode)],
+        batch_size, progress=progress, scope=mode
+    )
+    return [{"statement": stmt, "sport": sport} for stmt, sport in zip(statements, sports)]
+
+
+def label_fused(statements, batch_size=UNIFIED_BATCH_SIZE, checkpoint=None, progress=True):
+    fused = run_stage(
+        checkpoint, "fused", statements, statements,
+        lambda chunk: [[r["record"], r["sport"]] for r in classify_fused(chunk, batch_size=batch_size, progress=progress and checkpoint is None)],
+        batch_size, progress=progress
+    )
+    return [{"statement": stmt, "sport": sport} for stmt, (label, sport) in zip(statements, fused) if label == "Record"]
+
+
+def label_statements(statements, start_stage="records", batch_size=UNIFIED_BATCH_SIZE, checkpoint=None, progress=True, modes=None):
+    """Run the classification stages from `start_stage` on; returns sport results for Record statements.
+
+    With start_stage="sports" every statement is taken to be a Record; with start_stage="sql" the
+    input must already be {"statement", "sport"} dicts and no classifier model is loaded at all.
+    `modes` picks how each classifier runs, e.g. {"record": "score"}; {"fused": True} replaces both
+    classifiers with one pass of classify_fused.
+    """
+
+    modes = dict(DEFAULT_MODES, **(modes or {}))
+
+    if start_stage == "sql":
+        return statements
+
+    if start_stage == "records" and modes["fused"]:
+        with trace_span("fused", "stage", statement_count=len(statements)):
+            sport_results = label_fused(statements, batch_size=batch_size, checkpoint=checkpoint, progress=progress)
+        if progress:
+            print(f"Found {len(sport_results)} Record statements. Skipped {len(statements) - len(sport_results)} Non-Record.")
+        return sport_results
+
+    record_statements = statements
+    if start_stage == "records":
+        with trace_span("records", "stage", statement_count=len(statements)):
+            record_labels = label_records(statements, batch_size=batch_size, checkpoint=checkpoint, progress=progress,
+                                          mode=modes["record"], reuse_prefix=modes["record_prefix_cache"], pack_size=modes["record_pack_size"],
+                                          thresholds=modes["record_thresholds"], few_shot_k=modes["record_few_shot_k"],
+                                          few_shot_human=modes["record_few_shot_human"])
+        record_statements = [stmt for stmt, label in zip(statements, record_labels) if label == "Record"]
+        if progress:
+            print(f"Found {len(record_statements)} Record statements. Skipped {len(statements) - len(record_statements)} Non-Record.")
 
     if not record_statements:
-        print("No Record statements to process further.")
-        with open(output_path, 'w') as f:
-            json.dump([], f, indent=2)
-        return
+        return []
 
-    sport_results = classify_sports(record_statements, batch_size=UNIFIED_BATCH_SIZE)
+    with trace_span("sports", "stage", statement_count=len(record_statements)):
+        return label_sports(record_statements, batch_size=batch_size, checkpoint=checkpoint, progress=progress, mode=modes["sport"])
 
+
+def group_by_sport(sport_results):
     groups = {}
     for item in sport_results:
         sport = item["sport"]
         stmt = item["statement"]
-        if sport in ["baseball", "basketball", "cricket", "soccer"]:
+        if sport in SUPPORTED_SPORTS:
             groups.setdefault(sport, []).append(stmt)
         else:
             print(f"Skipping unsupported sport: '{sport}' for statement: {stmt[:50]}...")
+    return groups
+
 
+def process_sport(processor, sport, statements, batch_size=UNIFIED_BATCH_SIZE, checkpoint=None, rows=None):
+    try:
+        with trace_span("sql_pipeline", "stage", sport=sport, statement_count=len(statements)):
+            results = processor.process_statements(statements, batch_size=batch_size, checkpoint=checkpoint, rows=rows)
+        for r in results:
+            r["sport"] = sport
+        return results
+
+    except Exception as e:
+        print(f"Error processing {sport} statements: {e}")
+        return [{
+            "statement": stmt,
+            "sport": sport,
+            "error": f"Processing failed: {str(e)}"
+        } for stmt in statements]
+
+
+def make_processor(sport, profile=False, speculative=False, entity_thresholds=None):
+    # Sampled SQL generations are never cached, so decode greedily whenever the cache is on.
+    return SportsProcessor(sport, greedy=get_generation_cache() is not None, profile=profile, speculative=speculative,
+                           entity_thresholds=entity_thresholds)
+
+
+def _statement_text(item):
+    return item["statement"] if isinstance(item, dict) else item
+
+
+def input_rows(unique, positions, offset=0):
+    """Statement text -> the input rows (counted from `offset`) its unique item stands for."""
+    rows = [[] for _ in unique]
+    for row, pos in enumerate(positions):
+        rows[pos].append(offset + row)
+    return {_statement_text(item): item_rows for item, item_rows in zip(unique, rows)}
+
+
+def fan_out(items, unique, positions, results):
+    """Copy each unique statement's result back to every input row it stands for, in input order."""
+
+    by_statement = {r["statement"]: r for r in results}
+    fanned = []
+    for item, pos in zip(items, positions):
+        stmt = item["statement"] if isinstance(item, dict) else item
+        rep = unique[pos]["statement"] if isinstance(unique[pos], dict) else unique[pos]
+        if rep in by_statement:
+            fanned.append(dict(by_statement[rep], statement=stmt))
+    return fanned
+
+
+def sql_batch_size(residency, base_batch_size=UNIFIED_BATCH_SIZE):
+    """Batch size for the SQL stages; with a residency manager it grows into the memory the classifiers freed."""
+    if residency is None:
+        return base_batch_size
+    batch_size = residency.generation_batch_size("sports", base_batch_size, seq_len=SQL_STAGE_SEQ_LEN)
+    print(f"SQL stages will run with batch size {batch_size}")
+    return batch_size
+
+
+def run_pipeline(input_data, output_path="Results.json", stream=False, checkpoint_path=None, start_stage="records",
+                 manage_residency=False, memory_budget=None, cache_path=None, cache_max_entries=500_000,
+                 record_mode="generate", sport_mode="generate", record_prefix_cache=False, record_pack_size=None,
+                 record_thresholds=None, fused=False, record_few_shot_k=None, record_few_shot_human=False,
+                 profile=False, trace_path=None, memory_profile=False, speculative=False, budget_path=None,
+                 entity_thresholds=None):
+
+    if start_stage not in PIPELINE_STAGES:
+        raise ValueError(f"start_stage must be one of {PIPELINE_STAGES}, got '{start_stage}'")
+    modes = {"record": record_mode, "sport": sport_mode, "record_prefix_cache": record_prefix_cache,
+             "record_pack_size": record_pack_size, "record_thresholds": record_thresholds,
+             "fused": fused, "record_few_shot_k": record_few_shot_k, "record_few_shot_human": record_few_shot_human,
+             "profile": profile, "speculative": speculative, "entity_thresholds": entity_thresholds}
+
+    checkpoint = StageCheckpoint(checkpoint_path) if checkpoint_path else None
+    residency = ModelResidency(budget_bytes=memory_budget) if manage_residency else None
+    if stream and residency is not None and residency.budget_bytes is None:
+        # Streaming runs every stage on every batch; with no budget each model would be evicted and reloaded per batch.
+        raise ValueError("stream=True with manage_residency=True needs a memory_budget on CPU")
+    set_residency(residency)
+    cache = GenerationCache(cache_path, max_entries=cache_max_entries) if cache_path else None
+    set_generation_cache(cache)
+    tracer = TraceRecorder(trace_path) if trace_path else None
+    set_tracer(tracer)
+    memory = MemoryMonitor() if memory_profile else None
+    budgets = GenerationBudgets(budget_path) if budget_path else None
+    set_generation_budgets(budgets)
+    if memory is not None:
+        add_span_hook(memory.measure)
+    try:
+        if stream:
+            run_pipeline_streaming(input_data, output_path=output_path, checkpoint=checkpoint, start_stage=start_stage, residency=residency, modes=modes)
+        else:
+            _run_pipeline(input_data, output_path, checkpoint, start_stage, residency, modes)
+    finally:
+        padding_report()
+        stop_report()
+        if speculative:
+            speculative_report()
+        record_cascade_report()
+        sport_knn_report()
+        entity_report()
+        if checkpoint is not None:
+            checkpoint.close()
+        if residency is not None:
+            residency.report()
+            set_residency(None)
+        if cache is not None:
+            cache.report()
+            cache.close()
+            set_generation_cache(None)
+        if tracer is not None:
+            tracer.save()
+            set_tracer(None)
+        if budgets is not None:
+            budgets.report(MAX_NEW_TOKENS)
+            budgets.save()
+            set_generation_budgets(None)
+        if memory is not None:
+            remove_span_hook(memory.measure)
+            memory.report()
+            memory.close()
+
+
+def _run_pipeline(input_data, output_path, checkpoint, start_stage, residency=None, modes=None):
+    profile = (modes or {}).get("profile", False)
+    speculative = (modes or {}).get("speculative", False)
+    entity_thresholds = (modes or {}).get("entity_thresholds")
+
+    if start_stage == "sql":
+        all_statements = load_labelled_statements(input_data)
+    else:
+        all_statements = load_statements(input_data)
+    if not all_statements:
+        print("No valid statements found.")
+        return
+
+    unique_statements, positions = dedupe_statements(all_statements)
+    if len(unique_statements) < len(all_statements):
+        print(f"Collapsed {len(all_statements)} statements to {len(unique_statements)} unique statements.")
+
+    sport_results = label_statements(unique_statements, start_stage, batch_size=UNIFIED_BATCH_SIZE, checkpoint=checkpoint, modes=modes)
+
+    if not sport_results:
+        print("No Record statements to process further.")
+        with open(output_path, 'w') as f:
+            json.dump([], f, indent=2)
+        return
+
+    groups = group_by_sport(sport_results)
+    batch_size = sql_batch_size(residency)
+    rows = input_rows(unique_statements, positions)
 
     all_results = []
 
     for sport, statements in groups.items():
         print(f"Processing {len(statements)} {sport} statements...")
-        
+
         try:
-            processor = SportsProcessor(sport)
-            results = processor.process_statements(statements, batch_size=UNIFIED_BATCH_SIZE)
-
-            for r in results:
-                r["sport"] = sport
-                
-            all_results.extend(results)
-            print(f"Successfully processed {len(results)} {sport} statements")
-            
+            processor = make_processor(sport, profile=profile, speculative=speculative, entity_thresholds=entity_thresholds)
         except Exception as e:
-            print(f"Error processing {sport} statements: {e}")
-            for stmt in statements:
-                all_results.append({
-                    "statement": stmt,
-                    "sport": sport,
-                    "error": f"Processing failed: {str(e)}"
-                })
-                
+            print(f"Error loading {sport} processor: {e}")
+            all_results.extend({"statement": stmt, "sport": sport, "error": f"Processing failed: {str(e)}"} for stmt in statements)
+            continue
+
+        results = process_sport(processor, sport, statements, batch_size=batch_size, checkpoint=checkpoint,
+                                rows=[rows[stmt] for stmt in statements])
+        all_results.extend(results)
+        print(f"Successfully processed {len(results)} {sport} statements")
+        if processor.profiler.enabled:
+            processor.profiler.report(f"{sport} stage profile")
     
 
+    all_results = fan_out(all_statements, unique_statements, positions, all_results)
+
     with open(output_path, 'w') as f:
         json.dump(all_results, f, indent=2)
     print(f"\nFinal results saved to {output_path}")
     print(f"Total processed: {len(all_results)} statements across {len(groups)} sports")
 
 
+def stream_results(statements, batch_size=UNIFIED_BATCH_SIZE, checkpoint=None, start_stage="records", residency=None, modes=None,
+                   dedupe_entries=STREAM_DEDUPE_ENTRIES):
+    """Push statements through every stage one chunk at a time, yielding each finished result.
+
+    A statement whose canonical key is among the `dedupe_entries` most recently seen is not processed
+    again; its earlier result is reused. Older duplicates are recomputed (or restored from the checkpoint
+    and generation cache), so memory stays bounded whatever the input size.
+    """
+
+    profile = (modes or {}).get("profile", False)
+    speculative = (modes or {}).get("speculative", False)
+    entity_thresholds = (modes or {}).get("entity_thresholds")
+    processors = {}
+    sql_batch = None
+    # LRU of statement_key -> result, or None for a statement that produced no result (e.g. Non-Record).
+    finished = OrderedDict()
+    offset = 0
+
+    for batch in statements:
+        unique_statements, positions = dedupe_statements(batch)
+        rows = input_rows(unique_statements, positions, offset)
+        offset += len(batch)
+        found = {}
+        for item in unique_statements:
+            key = statement_key(_statement_text(item))
+            if key in finished:
+                finished.move_to_end(key)
+                found[key] = finished[key]
+        new = [item for item in unique_statements if statement_key(_statement_text(item)) not in found]
+        sport_results = label_statements(new, start_stage, batch_size=batch_size, checkpoint=checkpoint, progress=False, modes=modes) if new else []
+
+        batch_results = []
+        for sport, sport_statements in group_by_sport(sport_results).items():
+            try:
+                if sport not in processors:
+                    processors[sport] = make_processor(sport, profile=profile, speculative=speculative, entity_thresholds=entity_thresholds)
+            except Exception as e:
+                print(f"Error loading {sport} processor: {e}")
+                batch_results.extend({"statement": stmt, "sport": sport, "error": f"Processing failed: {str(e)}"} for stmt in sport_statements)
+                continue
+
+            if sql_batch is None:
+                sql_batch = sql_batch_size(residency, batch_size)
+            batch_results.extend(process_sport(processors[sport], sport, sport_statements, batch_size=sql_batch, checkpoint=checkpoint,
+                                               rows=[rows[stmt] for stmt in sport_statements]))
+
+        by_statement = {r["statement"]: r for r in batch_results}
+        for item in new:
+            key = statement_key(_statement_text(item))
+            found[key] = finished[key] = by_statement.get(_statement_text(item))
+        while len(finished) > dedupe_entries:
+            finished.popitem(last=False)
+        for item in batch:
+            result = found[statement_key(_statement_text(item))]
+            if result is not None:
+                yield dict(result, statement=_statement_text(item))
+
+    for sport, processor in processors.items():
+        if processor.profiler.enabled:
+            processor.profiler.report(f"{sport} stage profile")
+
+
+def run_pipeline_streaming(input_data, output_path="Results.jsonl", batch_size=UNIFIED_BATCH_SIZE, checkpoint=None, start_stage="records", residency=None, modes=None):
+
+    open(output_path, 'w').close()
+
+    statements = iter_labelled_statements(input_data) if start_stage == "sql" else iter_statements(input_data)
+    # Chunks of several generation batches, so length bucketing has prompts to sort.
+    batches = tqdm(batched(statements, batch_size * BUCKET_BATCHES), desc="Streaming chunks", unit="chunk")
+    total = 0
+    for result in stream_results(batches, batch_size=batch_size, checkpoint=checkpoint, start_stage=start_stage, residency=residency, modes=modes):
+        append_jsonl(output_path, [result])
+        total += 1
+
+    print(f"\nStreamed {total} results to {output_path}")
+
+
 
 
 if __name__ == "__main__":
@@ -92,4 +393,56 @@ if __name__ == "__main__":
     # 2. From CSV
     # statements = "statements.csv"
 
-    run_pipeline(statements, output_path="Results.json")
\ No newline at end of file
+    run_pipeline(statements, output_path="Results.json")
+
+    # 3. Streaming: results are appended to a JSONL file as each batch finishes
+    # run_pipeline("statements.csv", output_path="Results.jsonl", stream=True)
+
+    # 4. Resumable: every stage output is saved per statement, so a rerun skips finished stages
+    # run_pipeline("statements.csv", output_path="Results.json", checkpoint_path="checkpoint.db")
+
+    # 5. Start from a later stage: only the models that stage needs are loaded
+    # run_pipeline("LABELLED_DATASETS/Human/sport_statements.csv", output_path="Results.json", start_stage="sql")
+
+    # 6. Keep only the active stage's model resident and grow SQL batches into the freed memory
+    # run_pipeline("statements.csv", output_path="Results.json", manage_residency=True)
+
+    # 7. Reuse generations across runs; only prompts that changed are sent to the models again
+    # run_pipeline("statements.csv", output_path="Results.json", cache_path="generation_cache.db")
+
+    # 8. Classify records from one forward pass (next-token log-probabilities) instead of decoding
+    # run_pipeline("statements.csv", output_path="Results.json", record_mode="score", sport_mode="score")
+
+    # 9. Encode the record classifier's few-shot prefix once and reuse its KV cache for every batch
+    # run_pipeline("statements.csv", output_path="Results.json", record_prefix_cache=True)
+
+    # 10. Ask the record classifier about 8 statements per prompt; unparsed ones are re-asked individually
+    # run_pipeline("statements.csv", output_path="Results.json", record_pack_size=8)
+
+    # 11. Label confident statements from MiniLM embeddings on CPU; only uncertain ones reach the 70B model
+    # run_pipeline("statements.csv", output_path="Results.json", record_mode="cascade", record_thresholds=(0.05, 0.95))
+
+    # 12. Take the sport from the nearest human-labelled statements; the 8B model only sees ones whose neighbours disagree
+    # run_pipeline("statements.csv", output_path="Results.json", sport_mode="knn")
+
+    # 13. Label Record/Non-Record and the sport together from one forward pass of the record model
+    # run_pipeline("statements.csv", output_path="Results.json", fused=True)
+
+    # 14. Give each statement only its 8 most similar labelled examples instead of all 48 few-shot examples
+    # run_pipeline("statements.csv", output_path="Results.json", record_few_shot_k=8, record_prefix_cache=True)
+
+    # 15. Print wall time, tokens, padding, FAISS and SQL time per SQL-pipeline stage for each sport
+    # run_pipeline("statements.csv", output_path="Results.json", profile=True)
+
+    # 16. Write a Chrome/Perfetto trace of every stage, generate batch, FAISS lookup and SQL query (open in ui.perfetto.dev)
+    # run_pipeline("statements.csv", output_path="Results.json", trace_path="trace.json")
+
+    # 17. Report peak host RSS, Python allocations (with top allocators) and GPU peak per stage and generate batch
+    # run_pipeline("statements.csv", output_path="Results.json", memory_profile=True)
+
+    # 18. Let a small same-family draft model propose tokens for the 72B SQL stages (assisted generation)
+    # run_pipeline("statements.csv", output_path="Results.json", speculative=True)
+    # run_pipeline("statements.csv", output_path="Results.json", entity_thresholds="vector_db/entity_thresholds.json")
+
+    # 19. Learn per-sport, per-stage max_new_tokens budgets from observed output lengths, kept across runs
+    # run_pipeline("statements.csv", output_path="Results.json", budget_path="generation_budgets.json")
@@ -0,0 +1,147 @@
+import os
+import resource
+import tracemalloc
+from contextlib import contextmanager
+
+import torch
+
+
+# Span categories the memory monitor measures; "stage" spans also get tracemalloc allocator diffs.
+MEMORY_CATEGORIES = ["stage", "generate"]
+
+
+def host_peak_rss():
+    """Peak resident set size of this process (VmHWM, which reset_host_peak_rss can rewind on Linux)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_host_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+# Peaks of every open window so far, folded in before each reset. The host, tracemalloc and CUDA peak
+# counters are process-wide, so nothing else may reset them.
+_peak_windows = []
+
+
+def _current_peaks():
+    return {
+        "peak_rss": host_peak_rss(),
+        "peak_python": tracemalloc.get_traced_memory()[1],
+        "peak_accelerator": torch.cuda.max_memory_allocated() if torch.cuda.is_available() else None,
+    }
+
+
+def _merge(into, peaks):
+    for key in ("peak_rss", "peak_python", "peak_accelerator"):
+        value = peaks.get(key)
+        if value is not None:
+            into[key] = max(into.get(key) or 0, value)
+    return into
+
+
+def open_peak_window():
+    """Start measuring peaks from now; windows may nest or overlap without hiding each other's peaks.
+
+    Returns the window, to pass to peak_window_peaks and close_peak_window.
+    """
+
+    peaks = _current_peaks()
+    for window in _peak_windows:
+        _merge(window, peaks)
+    window = {}
+    _peak_windows.append(window)
+    reset_host_peak_rss()
+    tracemalloc.reset_peak()
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+    return window
+
+
+def peak_window_peaks(window):
+    """Peak host RSS, tracemalloc and accelerator memory since `window` opened."""
+    return _merge(dict(window), _current_peaks())
+
+
+def close_peak_window(window):
+    peaks = peak_window_peaks(window)
+    _peak_windows[:] = [w for w in _peak_windows if w is not window]
+    return peaks
+
+
+class MemoryMonitor:
+    """Peak host RSS, tracemalloc peak and top allocators, and accelerator peak allocation per stage and batch.
+
+    Registered as a tracing span hook, so it measures the same stage and generate-batch spans the trace
+    export records. Each span is a peak window, so nested spans (and the residency manager's own
+    per-stage windows) never hide each other's peaks.
+    """
+
+    def __init__(self, top=5):
+        self.top = top
+        self.stats = {}
+        self._started_tracemalloc = False
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def _key(self, name, cat, args):
+        if cat == "generate":
+            return f"{name}:{os.path.basename(str(args.get('model', '')))}".rstrip(":")
+        return f"{args['sport']}:{name}" if "sport" in args else name
+
+    @contextmanager
+    def measure(self, name, cat, args):
+        if cat not in MEMORY_CATEGORIES:
+            yield
+            return
+
+        snapshot = tracemalloc.take_snapshot() if cat == "stage" else None
+        window = open_peak_window()
+        try:
+            yield
+        finally:
+            peaks = close_peak_window(window)
+
+            stats = self.stats.setdefault(self._key(name, cat, args), {
+                "count": 0, "peak_rss": 0, "peak_python": 0, "peak_accelerator": None, "allocators": {}
+            })
+            stats["count"] += 1
+            _merge(stats, peaks)
+            if snapshot is not None:
+                for stat in tracemalloc.take_snapshot().compare_to(snapshot, "lineno")[:self.top]:
+                    where = str(stat.traceback[0])
+                    stats["allocators"][where] = stats["allocators"].get(where, 0) + stat.size_diff
+
+    def report(self):
+        """Print peaks per span and the top allocators per stage; returns the same numbers."""
+
+        print(f"\n{'Span':<32}{'Count':>7}{'RSS GiB':>9}{'Python MiB':>12}{'Accel GiB':>11}")
+        for key, s in self.stats.items():
+            accelerator = f"{s['peak_accelerator'] / 2**30:>11.2f}" if s["peak_accelerator"] is not None else f"{'-':>11}"
+            print(f"{key:<32}{s['count']:>7}{s['peak_rss'] / 2**30:>9.2f}{s['peak_python'] / 2**20:>12.1f}{accelerator}")
+
+        for key, s in self.stats.items():
+            top = sorted(s["allocators"].items(), key=lambda item: -item[1])[:self.top]
+            s["top_allocators"] = [{"location": where, "size_diff": size} for where, size in top]
+            if top:
+                print(f"\nTop allocators in {key}:")
+                for where, size in top:
+                    print(f"  {size / 2**20:>9.2f} MiB  {where}")
+
+        return {key: {k: v for k, v in s.items() if k != "allocators"} for key, s in self.stats.items()}
+
+    def close(self):
+        if self._started_tracemalloc:
+            tracemalloc.stop()
@@ -0,0 +1,202 @@
+import gc
+import time
+import resource
+
+import torch
+
+from memory import open_peak_window, peak_window_peaks, close_peak_window
+
+
+EMBEDDING_MODEL = '/scratch/nitishk_iitp/models/paraphrase-MiniLM-L6-v2'
+
+# Order in which the pipeline touches its models; earlier stages are evicted first.
+STAGE_ORDER = ["classify_records", "classify_sports", "sports"]
+
+
+_loaders = {}
+_loaded = {}
+# Model name -> stage model it only ever runs alongside (e.g. a draft model for assisted generation).
+_companions = {}
+_embedding_function = None
+_residency = None
+
+
+def register_model(name, loader, companion_of=None):
+    """Register a zero-argument `loader` returning (tokenizer, model); nothing is loaded until first use.
+
+    A model registered as `companion_of` a stage model is kept resident with that stage rather than
+    evicting it when activated.
+    """
+    _loaders[name] = loader
+    if companion_of is not None:
+        _companions[name] = companion_of
+
+
+def _load(name):
+    if name not in _loaders:
+        raise KeyError(f"No model registered under '{name}'")
+    print(f"Loading {name} model...")
+    start = time.perf_counter()
+    _loaded[name] = _loaders[name]()
+    elapsed = time.perf_counter() - start
+    print(f"Loaded {name} model in {elapsed:.1f}s")
+    return elapsed
+
+
+def get_model(name):
+    if _residency is not None:
+        return _residency.activate(name)
+    if name not in _loaded:
+        _load(name)
+    return _loaded[name]
+
+
+def is_loaded(name):
+    return name in _loaded
+
+
+def unload_model(name):
+    if name not in _loaded:
+        return
+    del _loaded[name]
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def set_residency(manager):
+    """Route every get_model() call through `manager` (or back to plain lazy loading with None)."""
+    global _residency
+    _residency = manager
+
+
+def get_embedding_function():
+    global _embedding_function
+    if _embedding_function is None:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        _embedding_function = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    return _embedding_function
+
+
+def memory_in_use():
+    if torch.cuda.is_available():
+        return torch.cuda.memory_allocated()
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def peak_memory(window):
+    """Peak accelerator allocation (host RSS on CPU) since the peak `window` opened."""
+    peaks = peak_window_peaks(window)
+    return peaks["peak_accelerator"] if torch.cuda.is_available() else peaks["peak_rss"]
+
+
+def kv_cache_bytes_per_token(model):
+    config = model.config
+    layers = config.num_hidden_layers
+    heads = config.num_attention_heads
+    kv_heads = getattr(config, "num_key_value_heads", None) or heads
+    head_dim = getattr(config, "head_dim", None) or config.hidden_size // heads
+    return 2 * layers * kv_heads * head_dim * torch.finfo(model.dtype).bits // 8
+
+
+class ModelResidency:
+    """Keeps only the active stage's model resident and sizes generation batches from the memory freed.
+
+    With no `budget_bytes`, every other model is evicted as soon as a stage activates. With a budget
+    (defaults to the device's total memory when CUDA is present), other models stay resident for as
+    long as their measured footprints fit, which avoids reloading when stages alternate per batch.
+    A streaming run alternates stages every batch, so it needs a budget (run_pipeline refuses one without).
+    """
+
+    def __init__(self, budget_bytes=None, stage_order=STAGE_ORDER):
+        if budget_bytes is None and torch.cuda.is_available():
+            budget_bytes = torch.cuda.get_device_properties(0).total_memory
+        self.budget_bytes = budget_bytes
+        self.stage_order = list(stage_order)
+        self.active = None
+        self._peak_window = None
+        self.footprints = {}
+        self.stats = {}
+
+    def _stage_stats(self, name):
+        return self.stats.setdefault(name, {
+            "loads": 0, "load_s": 0.0, "evictions": 0, "evict_s": 0.0, "peak_bytes": 0, "batch_size": None
+        })
+
+    def _close_active(self):
+        if self.active is not None:
+            stats = self._stage_stats(self.active)
+            stats["peak_bytes"] = max(stats["peak_bytes"], peak_memory(self._peak_window))
+            close_peak_window(self._peak_window)
+            self.active = self._peak_window = None
+
+    def evict(self, name):
+        if not is_loaded(name):
+            return
+        start = time.perf_counter()
+        unload_model(name)
+        stats = self._stage_stats(name)
+        stats["evictions"] += 1
+        stats["evict_s"] += time.perf_counter() - start
+        print(f"Evicted {name} model")
+
+    def _eviction_order(self, stage):
+        others = [n for n in _loaded if _companions.get(n, n) != stage]
+        rank = {n: i for i, n in enumerate(self.stage_order)}
+        # Stages that already ran go first, then the ones furthest away in pipeline order; companions go with their stage.
+        current = rank.get(stage, len(self.stage_order))
+        stage_rank = lambda n: rank.get(_companions.get(n, n), -1)
+        return sorted(others, key=lambda n: (stage_rank(n) > current, -abs(stage_rank(n) - current)))
+
+    def _fits(self, name):
+        if self.budget_bytes is None or name not in self.footprints:
+            return False
+        stage = _companions.get(name, name)
+        needed = self.footprints[name] + sum(self.footprints.get(n, 0) for n in _loaded if n != name and _companions.get(n, n) == stage)
+        resident = sum(self.footprints.get(n, self.budget_bytes) for n in _loaded if _companions.get(n, n) != stage)
+        return resident + needed <= self.budget_bytes
+
+    def activate(self, name):
+        stage = _companions.get(name, name)
+        switching = self.active != stage
+        if switching:
+            self._close_active()
+        if name not in _loaded:
+            for other in self._eviction_order(stage):
+                if self._fits(name):
+                    break
+                self.evict(other)
+        if switching:
+            self.active = stage
+            self._peak_window = open_peak_window()
+
+        if name not in _loaded:
+            elapsed = _load(name)
+            stats = self._stage_stats(name)
+            stats["loads"] += 1
+            stats["load_s"] += elapsed
+            self.footprints[name] = _loaded[name][1].get_memory_footprint()
+
+        return _loaded[name]
+
+    def generation_batch_size(self, name, base_batch_size, seq_len, max_batch_size=64, headroom=0.8):
+        """Largest batch whose KV cache for `seq_len` tokens fits in the memory left after loading `name`."""
+
+        _, model = self.activate(name)
+        batch_size = base_batch_size
+        if self.budget_bytes is not None:
+            free = self.budget_bytes - memory_in_use()
+            per_sequence = kv_cache_bytes_per_token(model) * seq_len
+            batch_size = max(base_batch_size, min(max_batch_size, int(free * headroom // per_sequence)))
+        self._stage_stats(name)["batch_size"] = batch_size
+        return batch_size
+
+    def report(self):
+        self._close_active()
+        print(f"\n{'Stage':<20}{'Loads':>7}{'Load s':>9}{'Evicts':>8}{'Evict s':>9}{'Peak GiB':>10}{'Batch':>7}")
+        for name in sorted(self.stats, key=lambda n: self.stage_order.index(n) if n in self.stage_order else len(self.stage_order)):
+            s = self.stats[name]
+            print(f"{name:<20}{s['loads']:>7}{s['load_s']:>9.1f}{s['evictions']:>8}{s['evict_s']:>9.1f}"
+                  f"{s['peak_bytes'] / 2**30:>10.2f}{s['batch_size'] if s['batch_size'] else '-':>7}")
+        return self.stats
@@ -0,0 +1,76 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+from generation import stats_snapshot
+
+
+# Generation counters attributed to whichever stage is open when they change.
+GENERATION_COUNTERS = ["prompt_tokens", "padded_tokens", "generated_tokens", "generate_calls"]
+
+
+class StageProfiler:
+    """Opt-in per-stage counters for SportsProcessor.process_statements.
+
+    Each stage records wall time and the generation work done while it was open; `timer` and `add`
+    attribute FAISS search time, SQL time and rows returned to the open stage. A disabled profiler
+    records nothing.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = {}
+        self._current = None
+
+    def _stage_stats(self, name):
+        return self.stages.setdefault(name, dict(
+            {"wall_s": 0.0, "faiss_s": 0.0, "sql_s": 0.0, "rows": 0},
+            **{counter: 0 for counter in GENERATION_COUNTERS}
+        ))
+
+    @contextmanager
+    def _stage(self, name):
+        stats = self._stage_stats(name)
+        outer, self._current = self._current, name
+        before = stats_snapshot()
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            stats["wall_s"] += time.perf_counter() - start
+            after = stats_snapshot()
+            for counter in GENERATION_COUNTERS:
+                stats[counter] += after[counter] - before[counter]
+            self._current = outer
+
+    def stage(self, name):
+        return self._stage(name) if self.enabled else nullcontext()
+
+    def add(self, key, value):
+        if self.enabled and self._current is not None:
+            self.stages[self._current][key] += value
+
+    @contextmanager
+    def _timer(self, key):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(key, time.perf_counter() - start)
+
+    def timer(self, key):
+        return self._timer(key) if self.enabled else nullcontext()
+
+    def report(self, title=None):
+        """Print the per-stage table and return {stage: counters}, with each stage's padding ratio filled in."""
+
+        for stats in self.stages.values():
+            padded = stats["padded_tokens"]
+            stats["padding_ratio"] = (padded - stats["prompt_tokens"]) / padded if padded else 0.0
+
+        if title:
+            print(f"\n{title}")
+        print(f"{'Stage':<10}{'Wall s':>8}{'Prompt tok':>12}{'Gen tok':>9}{'Pad %':>7}{'Calls':>7}{'FAISS s':>9}{'SQL s':>8}{'Rows':>7}")
+        for name, s in self.stages.items():
+            print(f"{name:<10}{s['wall_s']:>8.2f}{s['prompt_tokens']:>12}{s['generated_tokens']:>9}{s['padding_ratio']:>7.1%}"
+                  f"{s['generate_calls']:>7}{s['faiss_s']:>9.3f}{s['sql_s']:>8.3f}{s['rows']:>7}")
+        return self.stages
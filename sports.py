@@ -2,7 +2,6 @@ import os
 os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "expandable_segments:True"
 
 from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
-from langchain_huggingface import HuggingFaceEmbeddings
 import torch
 import ast
 import re
@@ -10,22 +9,55 @@ import numpy as np
 import pandas as pd
 import faiss
 import json
-from tqdm import tqdm
-
+import unicodedata
+from contextlib import contextmanager
+
+from checkpoint import run_stage
+from models import register_model, get_model, get_embedding_function
+from generation import generate
+from budgets import get_generation_budgets
+from sql_template import fill_template, placeholder_values
+from profiler import StageProfiler
+from tracing import trace_span, trace_tags
 from sql_db import execute_query, getBaseballStatFromDB, getBasketballStatFromDB, getCricketStatFromDB, getSoccerStatFromDB
 
-from baseball_prompts import getQUPrompt as getBaseballQUPrompt, getTemplatePrompt as getBaseballTemplatePrompt, getFullSQLPrompt as getBaseballFullSQLPrompt, getIdentifyEntityPrompt as getBaseballIdentifyEntityPrompt
+from baseball_prompts import getQUPrompt as getBaseballQUPrompt, getTemplatePrompt as getBaseballTemplatePrompt, getIdentifyEntityPrompt as getBaseballIdentifyEntityPrompt
 
-from basketball_prompts import getQUPrompt as getBasketballQUPrompt, getTemplatePrompt as getBasketballTemplatePrompt, getFullSQLPrompt as getBasketballFullSQLPrompt, getIdentifyEntityPrompt as getBasketballIdentifyEntityPrompt
+from basketball_prompts import getQUPrompt as getBasketballQUPrompt, getTemplatePrompt as getBasketballTemplatePrompt, getIdentifyEntityPrompt as getBasketballIdentifyEntityPrompt
 
-from cricket_prompts import getQUPrompt as getCricketQUPrompt, getTemplatePrompt as getCricketTemplatePrompt, getFullSQLPrompt as getCricketFullSQLPrompt, getIdentifyEntityPrompt as getCricketIdentifyEntityPrompt
+from cricket_prompts import getQUPrompt as getCricketQUPrompt, getTemplatePrompt as getCricketTemplatePrompt, getIdentifyEntityPrompt as getCricketIdentifyEntityPrompt
 
-from soccer_prompts import getQUPrompt as getSoccerQUPrompt, getTemplatePrompt as getSoccerTemplatePrompt, getFullSQLPrompt as getSoccerFullSQLPrompt, getIdentifyEntityPrompt as getSoccerIdentifyEntityPrompt
+from soccer_prompts import getQUPrompt as getSoccerQUPrompt, getTemplatePrompt as getSoccerTemplatePrompt, getIdentifyEntityPrompt as getSoccerIdentifyEntityPrompt
 
 
 MODEL = '/scratch/nitishk_iitp/models/Qwen2.5-72B-Instruct'
+# Same-family draft model for speculative (assisted) decoding of the SQL stages.
+DRAFT_MODEL = '/scratch/nitishk_iitp/models/Qwen2.5-0.5B-Instruct'
 BATCH_SIZE = 5
 MAX_NEW_TOKENS = 1024
+# Each stage's answer ends at its closing tag, so generation stops there instead of running to MAX_NEW_TOKENS.
+STOP_SEQUENCES = {
+    "qu": ["</QU>"],
+    "entity": ["</ID>"],
+    "template": ["</TemplateSQL>"],
+}
+
+SAMPLING_PARAMS = {"do_sample": True, "temperature": 0.1, "top_p": 0.9}
+# Deterministic decoding; generations made this way are reusable from the generation cache.
+GREEDY_PARAMS = {"do_sample": False}
+
+# Per sport: player mentions seen, accepted from the FAISS top-1 by similarity or by exact/normalized name,
+# and sent to the LLM for disambiguation.
+entity_stats = {}
+
+# Per-sport similarity thresholds calibrated on labelled (sport, mention, player_id) rows by
+# `python benchmark.py entity-gate <matches.csv>`. The similarity gate is opt-in (SportsProcessor's
+# entity_thresholds); without it, or for a sport the file has no threshold for, only name matches skip the LLM.
+ENTITY_THRESHOLDS_PATH = 'vector_db/entity_thresholds.json'
+# A threshold accepts top-1 matches only where at least ENTITY_GATE_PRECISION of the labelled ones at or
+# above it were right, over at least ENTITY_GATE_SUPPORT of them.
+ENTITY_GATE_PRECISION = 0.99
+ENTITY_GATE_SUPPORT = 20
 
 
 SPORT_CONFIGS = {
@@ -33,7 +65,6 @@ SPORT_CONFIGS = {
         "prompts": {
             "getQUPrompt": getBaseballQUPrompt,
             "getTemplatePrompt": getBaseballTemplatePrompt,
-            "getFullSQLPrompt": getBaseballFullSQLPrompt,
             "getIdentifyEntityPrompt": getBaseballIdentifyEntityPrompt
         },
         "db": {
@@ -45,14 +76,12 @@ SPORT_CONFIGS = {
             "team_index": "vector_db/baseball_team_index.bin",
             "player_ids": "vector_db/baseball_player_ids.npy",
             "team_ids": "vector_db/baseball_team_ids.npy"
-        },
-        "player_keywords": ["player", "hitter", "pitcher", "batter"]
+        }
     },
     "basketball": {
         "prompts": {
             "getQUPrompt": getBasketballQUPrompt,
             "getTemplatePrompt": getBasketballTemplatePrompt,
-            "getFullSQLPrompt": getBasketballFullSQLPrompt,
             "getIdentifyEntityPrompt": getBasketballIdentifyEntityPrompt
         },
         "db": {
@@ -64,14 +93,12 @@ SPORT_CONFIGS = {
             "team_index": "vector_db/basketball_team_index.bin",
             "player_ids": "vector_db/basketball_player_ids.npy",
             "team_ids": "vector_db/basketball_team_ids.npy"
-        },
-        "player_keywords": ["player", "scorer", "shooter"]
+        }
     },
     "cricket": {
         "prompts": {
             "getQUPrompt": getCricketQUPrompt,
             "getTemplatePrompt": getCricketTemplatePrompt,
-            "getFullSQLPrompt": getCricketFullSQLPrompt,
             "getIdentifyEntityPrompt": getCricketIdentifyEntityPrompt
         },
         "db": {
@@ -83,14 +110,12 @@ SPORT_CONFIGS = {
             "team_index": "vector_db/cricket_team_index.bin",
             "player_ids": "vector_db/cricket_player_ids.npy",
             "team_ids": "vector_db/cricket_team_ids.npy"
-        },
-        "player_keywords": ["player", "batsman", "bowler"]
+        }
     },
     "soccer": {
         "prompts": {
             "getQUPrompt": getSoccerQUPrompt,
             "getTemplatePrompt": getSoccerTemplatePrompt,
-            "getFullSQLPrompt": getSoccerFullSQLPrompt,
             "getIdentifyEntityPrompt": getSoccerIdentifyEntityPrompt
         },
         "db": {
@@ -102,44 +127,114 @@ SPORT_CONFIGS = {
             "team_index": "vector_db/soccer_team_index.bin",
             "player_ids": "vector_db/soccer_player_ids.npy",
             "team_ids": "vector_db/soccer_team_ids.npy"
-        },
-        "player_keywords": ["player", "scorer", "goal scorer", "striker", "midfielder", "defender"]
+        }
     }
 }
 
 
-bnb_config = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_use_double_quant=True,
-    bnb_4bit_quant_type="nf4",
-    bnb_4bit_compute_dtype=torch.bfloat16
-)
+def load_model():
+    bnb_config = BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_use_double_quant=True,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_compute_dtype=torch.bfloat16
+    )
+
+    tokenizer = AutoTokenizer.from_pretrained(
+        MODEL,
+        padding_side="left",
+        trust_remote_code=True,
+        local_files_only=True
+    )
+    tokenizer.pad_token_id = tokenizer.eos_token_id
+
+    model = AutoModelForCausalLM.from_pretrained(
+        MODEL,
+        quantization_config=bnb_config if torch.cuda.is_available() else None,
+        device_map="auto",
+        dtype=torch.bfloat16,
+        trust_remote_code=True,
+        local_files_only=True
+    )
+    return tokenizer, model
+
+
+register_model("sports", load_model)
+
+
+def load_draft_model():
+    tokenizer = AutoTokenizer.from_pretrained(DRAFT_MODEL, trust_remote_code=True, local_files_only=True)
+    model = AutoModelForCausalLM.from_pretrained(
+        DRAFT_MODEL,
+        device_map="auto",
+        dtype=torch.bfloat16,
+        trust_remote_code=True,
+        local_files_only=True
+    )
+    return tokenizer, model
+
+
+# Only used alongside the SQL model, so ModelResidency keeps it resident with (and evicts it with) "sports".
+register_model("sports_draft", load_draft_model, companion_of="sports")
+
+
+def normalize_name(name):
+    """Case-, accent- and punctuation-insensitive form of a person or team name."""
+    name = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode("ascii")
+    # Initials and apostrophes close up ("M.S." -> "ms", "O'Brien" -> "obrien"); other punctuation separates words.
+    name = re.sub(r"[.'\u2019]", "", name.lower())
+    return " ".join(re.sub(r"[^\w\s]", " ", name).split())
 
-tokenizer = AutoTokenizer.from_pretrained(
-    MODEL,
-    padding_side="left",
-    trust_remote_code=True,
-    local_files_only=True
-)
-tokenizer.pad_token_id = tokenizer.eos_token_id
 
-model = AutoModelForCausalLM.from_pretrained(
-    MODEL,
-    quantization_config=bnb_config,
-    device_map="auto",
-    dtype=torch.bfloat16,
-    trust_remote_code=True,
-    local_files_only=True
-)
+def calibrate_entity_threshold(similarities, correct, precision=ENTITY_GATE_PRECISION, support=ENTITY_GATE_SUPPORT):
+    """Lowest similarity at which accepting every top-1 match at or above it is still `precision` correct, or None."""
 
+    pairs = sorted(zip(similarities, correct), key=lambda pair: -pair[0])
+    threshold, right = None, 0
+    for n, (similarity, ok) in enumerate(pairs, 1):
+        right += bool(ok)
+        # Only cut between distinct similarities, since a threshold accepts every tie.
+        if n < len(pairs) and pairs[n][0] == similarity:
+            continue
+        if n >= support and right / n >= precision:
+            threshold = similarity
+    return threshold
 
-embedding_function = HuggingFaceEmbeddings(model_name='/scratch/nitishk_iitp/models/paraphrase-MiniLM-L6-v2')
+
+def load_entity_thresholds(path=ENTITY_THRESHOLDS_PATH):
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"No entity thresholds at {path}; calibrate them with `python benchmark.py entity-gate <matches.csv>`")
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_entity_thresholds(thresholds, path=ENTITY_THRESHOLDS_PATH):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(thresholds, f, indent=2)
+
+
+def entity_report():
+    """Print and return, per sport, how many entity disambiguation calls the fast path avoided."""
+
+    for sport, s in entity_stats.items():
+        avoided = s["accepted_similarity"] + s["accepted_name"]
+        rate = avoided / s["mentions"] if s["mentions"] else 0.0
+        print(f"Entity disambiguation ({sport}): {avoided} of {s['mentions']} player mentions accepted without the LLM "
+              f"({s['accepted_similarity']} by similarity, {s['accepted_name']} by name; {rate:.1%} avoided), "
+              f"{s['llm']} sent to the LLM")
+    return entity_stats
 
 
 class SportsProcessor:
-    def __init__(self, sport):
+    def __init__(self, sport, greedy=False, profile=False, speculative=False, entity_thresholds=None):
         self.sport = sport
         self.config = SPORT_CONFIGS[sport]
+        self.decoding = GREEDY_PARAMS if greedy else SAMPLING_PARAMS
+        self.speculative = speculative
+        self.profiler = StageProfiler(enabled=profile)
+        self.accept_similarity = load_entity_thresholds(entity_thresholds).get(sport) if entity_thresholds else None
+        self.entity_stats = entity_stats.setdefault(sport, {"mentions": 0, "accepted_similarity": 0, "accepted_name": 0, "llm": 0})
         self.faiss_indices = {}
         self.entity_id_maps = {}
         self._load_vector_dbs()
@@ -158,82 +253,145 @@ class SportsProcessor:
 
 
     
-    def getLLMResponseBatch(self, prompts, batch_size=BATCH_SIZE):
-        results = []
-        
-        for i in range(0, len(prompts), batch_size):
-            batch = prompts[i:i + batch_size]
-            formatted_prompts = []
-            
-            for prompt in batch:
-                messages = [{"role": "user", "content": prompt}]
-                formatted_prompt = tokenizer.apply_chat_template(
-                    messages,
-                    tokenize=False,
-                    add_generation_prompt=True
-                )
-                formatted_prompts.append(formatted_prompt)
-
-            inputs = tokenizer(
-                formatted_prompts,
-                return_tensors="pt",
-                padding=True,
-                truncation=True,
-                padding_side='left'
-            ).to(model.device)
-
-            generated_ids = model.generate(
-                **inputs,
-                max_new_tokens=MAX_NEW_TOKENS,
-                num_beams=1,
-                do_sample=True,
-                temperature=0.1,
-                top_p=0.9,
-                eos_token_id=tokenizer.eos_token_id,
-                pad_token_id=tokenizer.eos_token_id,
+    def getLLMResponseBatch(self, prompts, batch_size=BATCH_SIZE, stop=None):
+        tokenizer, model = get_model("sports")
+
+        formatted_prompts = []
+        for prompt in prompts:
+            messages = [{"role": "user", "content": prompt}]
+            formatted_prompt = tokenizer.apply_chat_template(
+                messages,
+                tokenize=False,
+                add_generation_prompt=True
             )
+            formatted_prompts.append(formatted_prompt)
+
+        budgets = get_generation_budgets()
+        if budgets is None or stop is None:
+            return self._generate(tokenizer, model, formatted_prompts, batch_size, MAX_NEW_TOKENS, stop)[0]
+
+        # Outputs that hit the learned budget without reaching their closing tag are retried with twice the budget.
+        budget = budgets.budget(self.sport, stop, MAX_NEW_TOKENS)
+        texts, lengths = self._generate(tokenizer, model, formatted_prompts, batch_size, budget, stop)
+        truncated = [i for i in range(len(texts)) if lengths[i] >= budget and not self._stopped(texts[i], stop)]
+        retried = len(truncated)
+        while truncated and budget < MAX_NEW_TOKENS:
+            budget = min(budget * 2, MAX_NEW_TOKENS)
+            retry_texts, retry_lengths = self._generate(
+                tokenizer, model, [formatted_prompts[i] for i in truncated], batch_size, budget, stop
+            )
+            for i, text, length in zip(truncated, retry_texts, retry_lengths):
+                texts[i], lengths[i] = text, length
+            truncated = [i for i in truncated if lengths[i] >= budget and not self._stopped(texts[i], stop)]
+
+        budgets.record(self.sport, stop, lengths, retried)
+        return texts
+
+    def _generate(self, tokenizer, model, formatted_prompts, batch_size, max_new_tokens, stop):
+        return generate(
+            MODEL, tokenizer, model, formatted_prompts,
+            batch_size=batch_size,
+            max_new_tokens=max_new_tokens,
+            decode_kwargs={"clean_up_tokenization_spaces": True},
+            num_beams=1,
+            eos_token_id=tokenizer.eos_token_id,
+            assistant=get_model("sports_draft") if self.speculative else None,
+            stop_strings=STOP_SEQUENCES[stop] if stop else None,
+            stop_label=stop,
+            return_lengths=True,
+            **self.decoding
+        )
+
+    @staticmethod
+    def _stopped(text, stop):
+        return any(tag in text for tag in STOP_SEQUENCES[stop])
 
-            batch_outputs = []
-            for j in range(len(generated_ids)):
-                generated_output = tokenizer.decode(
-                    generated_ids[j][inputs.input_ids.shape[1]:],
-                    skip_special_tokens=True,
-                    clean_up_tokenization_spaces=True
-                )
-                batch_outputs.append(generated_output)
-            
-            results.extend(batch_outputs)
+    
+    def findEntityMatchesBatch(self, mentions_by_type, top=1):
+        """{etype: {mention: [(id, cosine similarity)]}} for the `top` nearest indexed names of each mention.
+
+        Mentions of every type are de-duplicated and embedded in one pass, then searched with one
+        `index.search` per entity type.
+        """
+
+        unique = list(dict.fromkeys(m for mentions in mentions_by_type.values() for m in mentions))
+        results = {etype: {} for etype in mentions_by_type}
+        if not unique:
+            return results
+
+        with trace_span("findEntityIDs", "faiss", entities=len(unique)):
+            embeddings = np.array(get_embedding_function().embed_documents(unique), dtype=np.float32)
+            row = {m: k for k, m in enumerate(unique)}
+            unit = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+            for etype, mentions in mentions_by_type.items():
+                mentions = list(dict.fromkeys(mentions))
+                if not mentions:
+                    continue
+                index = self.faiss_indices[etype]
+                entity_ids = self.entity_id_maps[etype]
+                with self.profiler.timer("faiss_s"):
+                    _, indices = index.search(embeddings[[row[m] for m in mentions]], k=top)
+
+                # The indices hold raw (unnormalised) MiniLM vectors under L2, so the cosine similarity of each
+                # candidate is computed from its stored vector.
+                for i, ent in enumerate(mentions):
+                    results[etype][ent] = [
+                        (entity_ids[j].item(), self._cosine(unit[row[ent]], index.reconstruct(int(j))))
+                        for j in indices[i] if j >= 0
+                    ]
 
         return results
 
-    
-    def findEntityIDs(self, entities, etype, top=1):
 
-        if not entities:
-            return {}
+    @staticmethod
+    def _cosine(unit_query, stored):
+        return float(unit_query @ stored / max(np.linalg.norm(stored), 1e-12))
 
-        index = self.faiss_indices[etype]
-        entity_ids = self.entity_id_maps[etype]
 
-        query_embeddings = embedding_function.embed_documents(entities)
-        query_embeddings = np.array(query_embeddings, dtype=np.float32)
+    def findEntityMatches(self, entities, etype, top=1):
+        """[(id, cosine similarity)] of the `top` nearest indexed names for each mention."""
+        return self.findEntityMatchesBatch({etype: entities}, top)[etype]
 
-        distances, indices = index.search(query_embeddings, k=top)
 
-        results = {}
-        for i, ent in enumerate(entities):
-            best_match_ids = entity_ids[indices[i]]
-            results[ent] = best_match_ids.tolist()
-        
-        return results
+    def findEntityIDs(self, entities, etype, top=1):
+        return {ent: [i for i, _ in matches] for ent, matches in self.findEntityMatches(entities, etype, top).items()}
+
+
+    @staticmethod
+    def nameMatches(mention, entitiesData):
+        """Whether the mention is, up to case, accents and punctuation, the name of a candidate's stats row."""
+        names = {normalize_name(v) for row in entitiesData for k, v in row.items() if k.lower() == "player_name"}
+        return normalize_name(mention) in names
 
         
+    @contextmanager
+    def stage(self, name):
+        """Profile and trace one stage of process_statements."""
+        with self.profiler.stage(name), trace_span(name, "stage", sport=self.sport):
+            yield
+
+
+    def getStatFromDB(self, ids):
+        with self.profiler.timer("sql_s"), trace_span("getStatFromDB", "sql", ids=len(ids)):
+            entitiesData = self.config["db"]["getStatFromDB"](ids)
+        self.profiler.add("rows", len(entitiesData))
+        return entitiesData
+
+
+    def execute_query(self, sql):
+        with self.profiler.timer("sql_s"), trace_span("execute_query", "sql"):
+            columns, rows = self.config["db"]["execute_query"](sql)
+        self.profiler.add("rows", len(rows))
+        return columns, rows
+
+
     def getEntityId(self, statement, queriedEntity, entityData):
 
         entityprompt = self.config["prompts"]["getIdentifyEntityPrompt"](statement, queriedEntity, entityData)
         
         try:
-            llmResponse = self.getLLMResponseBatch([entityprompt])[0]
+            llmResponse = self.getLLMResponseBatch([entityprompt], stop="entity")[0]
             entityId = re.findall(r"<ID>(.*?)</ID>", llmResponse, flags=re.DOTALL)
             return entityId[0] if entityId else None
         except Exception as e:
@@ -241,70 +399,61 @@ class SportsProcessor:
             return None
 
     
-    def getEntityMetadata(self, finalqu_list, statements, batch_size=BATCH_SIZE):
+    def getEntityMetadata(self, finalqu_list, statements, batch_size=BATCH_SIZE, rows=None):
+        rows = rows or [[i] for i in range(len(statements))]
 
         all_prompts = []
         prompt_to_context = []
+        metadata_list = []
+
+        matches = self.findEntityMatchesBatch({
+            "player": [p for fq in finalqu_list for p in fq.get("player", [])],
+            "team": [t for fq in finalqu_list for t in fq.get("team", []) + fq.get("rivalteam", [])],
+        })
+        player_match_map = matches["player"]
+        team_id_map = {team: [i for i, _ in m] for team, m in matches["team"].items()}
 
         for idx, (statement, finalqu) in enumerate(zip(statements, finalqu_list)):
-            players = finalqu.get("player", [])
-            teams = finalqu.get("team", []) + finalqu.get("rivalteam", [])
-            entities = players + teams
-
-            player_id_map = self.findEntityIDs(players, "player")
-            team_id_map = self.findEntityIDs(teams, "team")
-
-            metadata = {}
-            for player in players:
-                ids = player_id_map.get(player, [])
-                if not ids:
-                    metadata[player] = None
-                    continue
-                
-                entitiesData = self.config["db"]["getStatFromDB"](ids)
-                if entitiesData:
-                    prompt = self.config["prompts"]["getIdentifyEntityPrompt"](statement, player, entitiesData)
-                    all_prompts.append(prompt)
-                    prompt_to_context.append((idx, player, ids, entitiesData))
-                else:
-                    metadata[player] = ids[0] if ids else None
+            with trace_tags(statement=rows[idx][0], rows=rows[idx]):
+                players = finalqu.get("player", [])
+                teams = finalqu.get("team", []) + finalqu.get("rivalteam", [])
+
+                metadata = {}
+                for player in players:
+                    player_matches = player_match_map.get(player, [])
+                    ids = [i for i, _ in player_matches]
+                    if not ids:
+                        metadata[player] = None
+                        continue
+
+                    # Confident top-1 matches skip the LLM; only ambiguous mentions are disambiguated.
+                    self.entity_stats["mentions"] += 1
+                    if self.accept_similarity is not None and player_matches[0][1] >= self.accept_similarity:
+                        self.entity_stats["accepted_similarity"] += 1
+                        metadata[player] = ids[0]
+                        continue
+
+                    entitiesData = self.getStatFromDB(ids)
+                    if entitiesData and self.nameMatches(player, entitiesData):
+                        self.entity_stats["accepted_name"] += 1
+                        metadata[player] = ids[0]
+                    elif entitiesData:
+                        self.entity_stats["llm"] += 1
+                        prompt = self.config["prompts"]["getIdentifyEntityPrompt"](statement, player, entitiesData)
+                        all_prompts.append(prompt)
+                        prompt_to_context.append((idx, player, ids, entitiesData))
+                    else:
+                        metadata[player] = ids[0] if ids else None
 
-            for team in teams:
-                ids = team_id_map.get(team, [])
-                metadata[team] = ids[0] if ids else None
+                for team in teams:
+                    ids = team_id_map.get(team, [])
+                    metadata[team] = ids[0] if ids else None
+                metadata_list.append(metadata)
 
         if not all_prompts:
-            metadata_list = []
-            for idx, (statement, finalqu) in enumerate(zip(statements, finalqu_list)):
-                players = finalqu.get("player", [])
-                teams = finalqu.get("team", []) + finalqu.get("rivalteam", [])
-                player_id_map = self.findEntityIDs(players, "player")
-                team_id_map = self.findEntityIDs(teams, "team")
-                
-                md = {}
-                for p in players:
-                    ids = player_id_map.get(p, [])
-                    md[p] = ids[0] if ids else None
-                for t in teams:
-                    ids = team_id_map.get(t, [])
-                    md[t] = ids[0] if ids else None
-                metadata_list.append(md)
             return metadata_list
 
-        llm_responses = self.getLLMResponseBatch(all_prompts, batch_size=batch_size)
-
-        metadata_list = [{} for _ in statements]
-        for idx, (statement, finalqu) in enumerate(zip(statements, finalqu_list)):
-            players = finalqu.get("player", [])
-            teams = finalqu.get("team", []) + finalqu.get("rivalteam", [])
-            player_id_map = self.findEntityIDs(players, "player")
-            team_id_map = self.findEntityIDs(teams, "team")
-        
-            md = {}
-            for t in teams:
-                ids = team_id_map.get(t, [])
-                md[t] = ids[0] if ids else None
-            metadata_list[idx] = md
+        llm_responses = self.getLLMResponseBatch(all_prompts, batch_size=batch_size, stop="entity")
 
         for response, (stmt_idx, entity_name, candidate_ids, entitiesData) in zip(llm_responses, prompt_to_context):
             try:
@@ -324,7 +473,7 @@ class SportsProcessor:
     def getQU_batch(self, statements, batch_size=BATCH_SIZE):
 
         prompts = [self.config["prompts"]["getQUPrompt"](s) for s in statements]
-        responses = self.getLLMResponseBatch(prompts, batch_size=batch_size)
+        responses = self.getLLMResponseBatch(prompts, batch_size=batch_size, stop="qu")
 
         final_results = []
         for i, conversation in enumerate(responses):
@@ -362,7 +511,7 @@ class SportsProcessor:
     def getTemplateSQL_batch(self, finalqu_list, statements, batch_size=BATCH_SIZE):
         
         prompts = [self.config["prompts"]["getTemplatePrompt"](finalqu, s) for finalqu, s in zip(finalqu_list, statements)]
-        responses = self.getLLMResponseBatch(prompts, batch_size=batch_size)
+        responses = self.getLLMResponseBatch(prompts, batch_size=batch_size, stop="template")
 
         templates = []
         
@@ -401,93 +550,79 @@ class SportsProcessor:
 
         
     def getFullSQL_batch(self, finalqu_list, templates, metadata_list, batch_size=BATCH_SIZE):
-        
-        prompts = [self.config["prompts"]["getFullSQLPrompt"](fq, t, md) for fq, t, md in zip(finalqu_list, templates, metadata_list)]
-        responses = self.getLLMResponseBatch(prompts, batch_size=batch_size)
+        """Bind entity ids from the metadata into each template SQL, dropping conditions that cannot be bound."""
 
         sqls = []
-        
-        for i, conversation in enumerate(responses):
+        for i, (finalqu, template_sql, metadata) in enumerate(zip(finalqu_list, templates, metadata_list)):
             try:
-                assistant_response = ""
-                if isinstance(conversation, list):
-                    for msg in conversation:
-                        if msg.get('role') == 'assistant':
-                            assistant_response = msg.get('content', '')
-                            break
+                if template_sql:
+                    sqls.append(fill_template(template_sql, placeholder_values(finalqu, metadata or {})))
                 else:
-                    assistant_response = str(conversation)
-                
-                sql_matches = re.findall(r'<SQL>(.*?)</SQL>', assistant_response, flags=re.DOTALL | re.IGNORECASE)
-                
-                if sql_matches:
-                    sql = sql_matches[0].strip()
-                    sqls.append(sql)
-                else:
-                    template_sql = templates[i] if i < len(templates) else ""
-                    metadata = metadata_list[i] if i < len(metadata_list) else {}
-                    
-                    if template_sql and metadata:
-                        sql = template_sql
-
-                        record_context = " ".join(finalqu_list[i].get("recordcontext", [])).lower()
-                        filter_players = any(word in record_context for word in self.config["player_keywords"])
-                        
-                        for entity_name, entity_id in metadata.items():
-                            if entity_id is not None:
-                                
-                                if entity_name in finalqu_list[i].get("rivalteam", []):
-                                    if "##rivalteamid##" in sql:
-                                        sql = sql.replace("##rivalteamid##", str(entity_id))
-                                
-                                elif entity_name in finalqu_list[i].get("venue", []):
-                                    if "##venueid##" in sql:
-                                        sql = sql.replace("##venueid##", str(entity_id))
-                                
-                                elif entity_name in finalqu_list[i].get("player", []):
-                                    if filter_players and "##playerid##" in sql:
-                                        sql = sql.replace("##playerid##", str(entity_id))
-                        
-                        sql = re.sub(r'##\w+##', 'NULL', sql)
-                        sqls.append(sql)
-                    else:
-                        sqls.append(template_sql if template_sql else "SELECT 1;")
-                        
+                    sqls.append("SELECT 1;")
             except Exception as e:
-                print(f"Error extracting full SQL from response {i}: {e}")
+                print(f"Error filling template SQL {i}: {e}")
                 sqls.append("SELECT 1;")
-        
+
         return sqls
 
 
         
-    def process_statements(self, statements, batch_size=BATCH_SIZE):
+    def process_statements(self, statements, batch_size=BATCH_SIZE, checkpoint=None, rows=None):
+        """Run every SQL stage over `statements` and execute the result.
+
+        `rows` lists, per statement, the input rows it stands for; spans are tagged with them (the first
+        as `statement`), so a trace points back at the input whatever the deduping and chunking.
+        """
         results = []
 
         if isinstance(statements, str):
             statements = [statements]
+        rows = rows or [[i] for i in range(len(statements))]
 
-        finalqu_list = self.getQU_batch(statements, batch_size=batch_size)
-        metadata_list = self.getEntityMetadata(finalqu_list, statements, batch_size=batch_size)
-        templates = self.getTemplateSQL_batch(finalqu_list, statements, batch_size=batch_size)
-        sqls = self.getFullSQL_batch(finalqu_list, templates, metadata_list, batch_size=batch_size)
+        with self.stage("qu"):
+            finalqu_list = run_stage(
+                checkpoint, "qu", statements, statements,
+                lambda chunk: self.getQU_batch(chunk, batch_size=batch_size),
+                batch_size, scope=self.sport
+            )
+        with self.stage("metadata"):
+            metadata_list = run_stage(
+                checkpoint, "metadata", statements, list(zip(finalqu_list, statements, rows)),
+                lambda chunk: self.getEntityMetadata([fq for fq, _, _ in chunk], [s for _, s, _ in chunk], batch_size=batch_size,
+                                                     rows=[r for _, _, r in chunk]),
+                batch_size, scope=self.sport
+            )
+        with self.stage("template"):
+            templates = run_stage(
+                checkpoint, "template", statements, list(zip(finalqu_list, statements)),
+                lambda chunk: self.getTemplateSQL_batch([fq for fq, _ in chunk], [s for _, s in chunk], batch_size=batch_size),
+                batch_size, scope=self.sport
+            )
+        with self.stage("sql"):
+            sqls = run_stage(
+                checkpoint, "sql", statements, list(zip(finalqu_list, templates, metadata_list)),
+                lambda chunk: self.getFullSQL_batch(*map(list, zip(*chunk)), batch_size=batch_size),
+                batch_size, scope=self.sport
+            )
 
-        for st, fq, md, template, sql in zip(statements, finalqu_list, metadata_list, templates, sqls):
-            try:
-                columns, rows = self.config["db"]["execute_query"](sql)
-                results.append({
-                    "statement": st,
-                    "results": {"columns": columns, "rows": rows}
-                })
-            except Exception as e:
-                results.append({
-                    "statement": st,
-                    "qu": fq,
-                    "template_sql": template,
-                    "entity_metadata": md,
-                    "sql": sql,
-                    "error": str(e)
-                })
+        with self.stage("execute"):
+            for st, statement_rows, fq, md, template, sql in zip(statements, rows, finalqu_list, metadata_list, templates, sqls):
+                try:
+                    with trace_tags(statement=statement_rows[0], rows=statement_rows):
+                        columns, rows = self.execute_query(sql)
+                    results.append({
+                        "statement": st,
+                        "results": {"columns": columns, "rows": rows}
+                    })
+                except Exception as e:
+                    results.append({
+                        "statement": st,
+                        "qu": fq,
+                        "template_sql": template,
+                        "entity_metadata": md,
+                        "sql": sql,
+                        "error": str(e)
+                    })
         
         return results
 
@@ -0,0 +1,197 @@
+import re
+
+
+# Template placeholder -> QU role whose resolved entity id fills it.
+PLACEHOLDER_ROLES = {
+    "playerid": "player",
+    "teamid": "team",
+    "rivalteamid": "rivalteam",
+    "venueid": "venue",
+}
+
+PLACEHOLDER_RE = re.compile(r"##(\w+)##")
+TOKEN_RE = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*'|"(?:[^"]|"")*")
+  | (?P<placeholder>\#\#\w+\#\#)
+  | (?P<word>\w+)
+  | (?P<open>\()
+  | (?P<close>\))
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+# Clauses whose predicates are pruned, and the keywords that end one.
+PREDICATE_CLAUSES = {"WHERE", "HAVING", "ON"}
+CLAUSE_ENDS = PREDICATE_CLAUSES | {
+    "GROUP", "ORDER", "LIMIT", "OFFSET", "WINDOW", "UNION", "EXCEPT", "INTERSECT",
+    "JOIN", "LEFT", "RIGHT", "INNER", "OUTER", "CROSS", "FULL", "NATURAL",
+}
+
+
+class TemplateBindingError(ValueError):
+    """The template cannot be bound without changing what the query means (e.g. emptying a join condition)."""
+
+
+def placeholder_values(finalqu, metadata):
+    """Entity id for each placeholder: the first entity of its QU role that resolved to an integer id.
+
+    Metadata is keyed by entity name, or by the role itself; ids that are missing, None or not integers
+    leave the placeholder unbound.
+    """
+
+    values = {}
+    for placeholder, role in PLACEHOLDER_ROLES.items():
+        for key in list(finalqu.get(role, [])) + [role]:
+            value = str(metadata.get(key)).strip() if metadata.get(key) is not None else ""
+            if re.fullmatch(r"-?\d+", value):
+                values[placeholder] = value
+                break
+    return values
+
+
+class _Group(list):
+    """Tokens between a pair of parentheses."""
+
+
+def _parse(sql):
+    stack = [[]]
+    for m in TOKEN_RE.finditer(sql):
+        if m.lastgroup == "open":
+            stack.append(_Group())
+        elif m.lastgroup == "close" and len(stack) > 1:
+            group = stack.pop()
+            stack[-1].append(group)
+        else:
+            stack[-1].append(m.group())
+    while len(stack) > 1:
+        group = stack.pop()
+        stack[-1].append(group)
+    return stack[0]
+
+
+def _render(items):
+    return "".join(f"({_render(i)})" if isinstance(i, _Group) else i for i in items)
+
+
+def _is_space(item):
+    return isinstance(item, str) and (item.isspace() or item.startswith("--") or item.startswith("/*"))
+
+
+def _keyword(item):
+    return item.upper() if isinstance(item, str) and re.fullmatch(r"\w+", item) else None
+
+
+def _has_placeholder(items):
+    return any(_has_placeholder(i) if isinstance(i, _Group) else PLACEHOLDER_RE.fullmatch(i) for i in items)
+
+
+def _is_subquery(group):
+    first = next((i for i in group if not _is_space(i)), None)
+    return _keyword(first) in ("SELECT", "WITH")
+
+
+def _split(items, keyword):
+    """Split on a top-level AND/OR, leaving the AND of `BETWEEN x AND y` alone."""
+
+    parts, current, open_between = [], [], False
+    for item in items:
+        word = _keyword(item)
+        if word == "BETWEEN":
+            open_between = True
+        if word == keyword and not (keyword == "AND" and open_between):
+            parts.append(current)
+            current = []
+            continue
+        if word == "AND" and open_between:
+            open_between = False
+        current.append(item)
+    parts.append(current)
+    return parts
+
+
+def _strip(items):
+    start, end = 0, len(items)
+    while start < end and _is_space(items[start]):
+        start += 1
+    while end > start and _is_space(items[end - 1]):
+        end -= 1
+    return items[start:end]
+
+
+def _prune_disjunction(items):
+    """Prune each OR branch (AND binds tighter, so a branch is a conjunction); a branch left empty is dropped.
+
+    None if no branch is left.
+    """
+
+    branches = [b for b in (_prune_conjunction(_strip(part)) for part in _split(items, "OR")) if b]
+    if not branches:
+        return None
+    return [token for k, b in enumerate(branches) for token in ([" OR "] if k else []) + b]
+
+
+def _prune_conjunction(items):
+    """Drop every AND-ed predicate with an unbound placeholder; None if nothing is left."""
+
+    kept = [c for c in (_prune_predicate(_strip(part)) for part in _split(items, "AND")) if c]
+    if not kept:
+        return None
+    return [token for k, c in enumerate(kept) for token in ([" AND "] if k else []) + c]
+
+
+def _prune_predicate(items):
+    if not _has_placeholder(items):
+        return items
+    # A parenthesised condition is pruned inside, and goes as a whole only when nothing in it is left.
+    if len(items) == 1 and isinstance(items[0], _Group) and not _is_subquery(items[0]):
+        kept = _prune_disjunction(_strip(items[0]))
+        return [_Group(kept)] if kept else None
+    return None
+
+
+def _rewrite(items):
+    """Prune the WHERE/HAVING/ON predicates of one nesting level, recursing into subqueries."""
+
+    items = [_Group(_rewrite(i)) if isinstance(i, _Group) and _is_subquery(i) else i for i in items]
+
+    out, k = [], 0
+    while k < len(items):
+        word = _keyword(items[k])
+        if word not in PREDICATE_CLAUSES:
+            out.append(items[k])
+            k += 1
+            continue
+
+        end = k + 1
+        while end < len(items) and _keyword(items[end]) not in CLAUSE_ENDS and items[end] != ";":
+            end += 1
+        body = items[k + 1:end]
+        trailing = body[len(body) - next((n for n, i in enumerate(reversed(body)) if not _is_space(i)), len(body)):]
+
+        kept = _prune_disjunction(_strip(body)) if _has_placeholder(body) else _strip(body)
+        if not kept and word == "ON":
+            raise TemplateBindingError(f"Join condition '{_render(_strip(body))}' has no bound predicate left")
+        if kept:
+            out += [items[k], " "] + kept + trailing
+        else:
+            # Drop the keyword with its predicates, and the whitespace in front of it.
+            while out and _is_space(out[-1]):
+                out.pop()
+            out += trailing or ([" "] if end < len(items) and items[end] != ";" else [])
+        k = end
+    return out
+
+
+def fill_template(template_sql, values):
+    """Bind `values` ({placeholder: id}) into a template SQL; conditions whose placeholder is unbound are removed.
+
+    Predicates are dropped from WHERE, HAVING and ON clauses, including inside subqueries: an unbound
+    AND-ed predicate is removed, an OR branch left empty goes, and so does a WHERE/HAVING clause left
+    empty. A join condition left empty raises TemplateBindingError rather than becoming a cross join.
+    An unbound placeholder anywhere else becomes NULL.
+    """
+
+    sql = PLACEHOLDER_RE.sub(lambda m: values.get(m.group(1).lower(), m.group()), template_sql)
+    sql = _render(_rewrite(_parse(sql)))
+    return PLACEHOLDER_RE.sub("NULL", sql).strip()
@@ -0,0 +1,115 @@
+import os
+import sys
+import hashlib
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+
+
+class HashEmbeddings:
+    """Bag-of-words hash embeddings; deliberately not unit length, like MiniLM through HuggingFaceEmbeddings."""
+
+    dim = 64
+
+    def embed_documents(self, texts):
+        vectors = []
+        for text in texts:
+            v = np.zeros(self.dim, dtype=np.float32)
+            for word in text.lower().split():
+                v[int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dim] += 1.0
+            vectors.append((v * (1 + len(text))).tolist())
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+@pytest.fixture
+def fake_embeddings(monkeypatch):
+    embeddings = HashEmbeddings()
+    monkeypatch.setattr(models, "_embedding_function", embeddings)
+    return embeddings
+
+
+@pytest.fixture(scope="session")
+def tiny_model_dir(tmp_path_factory):
+    """A tiny random Llama and BPE tokenizer saved to disk, standing in for the real checkpoints."""
+    import torch
+    from tokenizers import Tokenizer, models as tok_models, trainers, pre_tokenizers, decoders
+    from transformers import PreTrainedTokenizerFast, LlamaConfig, LlamaForCausalLM
+
+    path = str(tmp_path_factory.mktemp("tiny"))
+    texts = ["Virat Kohli scored the most runs in an ODI innings against England",
+             "SELECT player_id, player_name FROM player_performance WHERE team_id = 1 LIMIT 5;",
+             "<QU> <ID> </ID> </QU> <TemplateSQL> </TemplateSQL> Record Non-Record baseball cricket soccer basketball"] * 20
+    tokenizer = Tokenizer(tok_models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.train_from_iterator(texts, trainers.BpeTrainer(
+        vocab_size=400, special_tokens=["<eos>", "<bos>"], initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    ))
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<eos>", bos_token="<bos>",
+                                        pad_token="<eos>", padding_side="left")
+    tokenizer.chat_template = ("{% for m in messages %}<|{{ m['role'] }}|>{{ m['content'] }}\n{% endfor %}"
+                               "{% if add_generation_prompt %}<|assistant|>{% endif %}")
+    tokenizer.save_pretrained(path)
+
+    torch.manual_seed(0)
+    model = LlamaForCausalLM(LlamaConfig(
+        vocab_size=len(tokenizer), hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=2, eos_token_id=0, bos_token_id=1, pad_token_id=0
+    ))
+    model.save_pretrained(path)
+    return path
+
+
+@pytest.fixture
+def tiny_loader(tiny_model_dir):
+    """Zero-argument loader for register_model returning a fresh (tokenizer, model) pair."""
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+
+    def load():
+        return (AutoTokenizer.from_pretrained(tiny_model_dir, padding_side="left"),
+                AutoModelForCausalLM.from_pretrained(tiny_model_dir))
+    return load
+
+
+@pytest.fixture
+def clean_registry(monkeypatch):
+    """Isolate the model registry, loaded models and residency manager from other tests."""
+    monkeypatch.setattr(models, "_loaders", dict(models._loaders))
+    monkeypatch.setattr(models, "_companions", dict(models._companions))
+    monkeypatch.setattr(models, "_loaded", {})
+    monkeypatch.setattr(models, "_residency", None)
+
+
+@pytest.fixture
+def entity_processor(monkeypatch, fake_embeddings):
+    """SportsProcessor over small in-memory player/team indices built the way vector_store.py builds them."""
+    import faiss
+    import sports
+
+    players = {10: "Virat Kohli", 11: "Rohit Sharma", 12: "M.S. Dhoni"}
+    teams = {1: "India", 2: "England"}
+
+    def load_vector_dbs(self):
+        self.faiss_indices, self.entity_id_maps = {}, {}
+        for etype, entities, index in (("player", players, faiss.IndexFlatL2(HashEmbeddings.dim)),
+                                       ("team", teams, faiss.IndexHNSWFlat(HashEmbeddings.dim, 32))):
+            index.add(np.array(fake_embeddings.embed_documents(list(entities.values())), dtype=np.float32))
+            self.faiss_indices[etype] = index
+            self.entity_id_maps[etype] = np.array(list(entities))
+
+    monkeypatch.setattr(sports.SportsProcessor, "_load_vector_dbs", load_vector_dbs)
+    monkeypatch.setattr(sports, "entity_stats", {})
+
+    processor = sports.SportsProcessor("cricket", greedy=True)
+    processor.config = dict(processor.config, db=dict(
+        processor.config["db"],
+        getStatFromDB=lambda ids: [{"player_id": i, "player_name": players[i]} for i in ids]
+    ))
+    return processor
@@ -0,0 +1,22 @@
+import pytest
+
+from benchmark import stage_report, held_out
+
+
+def test_macro_average_skips_labels_without_support():
+    labels = ["baseball", "cricket", "soccer", "baseball"]
+    report = stage_report(labels, labels, ["baseball", "basketball", "cricket", "soccer"], [1.0], {
+        "prompt_tokens": 0, "generated_tokens": 0, "generate_calls": 0
+    })
+
+    assert report["precision"] == pytest.approx(1.0)
+    assert report["recall"] == pytest.approx(1.0)
+    assert report["per_label"]["basketball"] == {"precision": 0.0, "recall": 0.0, "support": 0}
+    assert report["per_label"]["baseball"]["support"] == 2
+
+
+def test_held_out_split_is_disjoint_and_deterministic():
+    train, test = held_out(range(100), 0.2, seed=0)
+    assert len(train) == 80 and len(test) == 20
+    assert not set(train) & set(test)
+    assert held_out(range(100), 0.2, seed=0) == (train, test)
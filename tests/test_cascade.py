@@ -0,0 +1,21 @@
+from cascade import SportKNN
+
+
+TRAIN = [
+    ("most home runs in a single season", "baseball"),
+    ("most home runs in a world series game", "baseball"),
+    ("most strikeouts by a pitcher in a season", "baseball"),
+    ("most runs in an odi innings", "cricket"),
+    ("most wickets in a test match", "cricket"),
+]
+
+
+def test_sport_knn_escalates_a_distant_query(fake_embeddings):
+    knn = SportKNN.build([s for s, _ in TRAIN], [sport for _, sport in TRAIN], k=3, agreement=0.6, min_similarity=0.5)
+
+    distant = knn.neighbours(["fastest lap at monaco grand prix"])[0]
+    assert max(similarity for _, similarity in distant) < 0.5
+    # On agreement alone the distant query would be called cricket.
+    assert knn.vote(distant, min_similarity=-1.0) == "cricket"
+    assert knn.decide(["most home runs in a season", "fastest lap at monaco grand prix"]) == ["baseball", None]
+    assert knn.stats == {"statements": 2, "decided": 1, "escalated": 1}
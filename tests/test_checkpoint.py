@@ -0,0 +1,51 @@
+from checkpoint import StageCheckpoint, run_stage
+
+
+def test_saved_outputs_are_scoped_by_sport_and_mode(tmp_path):
+    checkpoint = StageCheckpoint(str(tmp_path / "checkpoint.db"))
+    statements = ["Kohli scored the most runs"]
+    calls = []
+
+    def stage(label):
+        def fn(chunk):
+            calls.append(label)
+            return [label for _ in chunk]
+        return fn
+
+    assert run_stage(checkpoint, "qu", statements, statements, stage("cricket"), 5, scope="cricket") == ["cricket"]
+    assert run_stage(checkpoint, "qu", statements, statements, stage("baseball"), 5, scope="baseball") == ["baseball"]
+    assert run_stage(checkpoint, "qu", statements, statements, stage("again"), 5, scope="cricket") == ["cricket"]
+    assert run_stage(checkpoint, "record", statements, statements, stage("score"), 5, scope="score") == ["score"]
+    assert run_stage(checkpoint, "record", statements, statements, stage("generate"), 5, scope="generate") == ["generate"]
+    assert calls == ["cricket", "baseball", "score", "generate"]
+    checkpoint.close()
+
+
+def test_chunks_span_several_generation_batches(tmp_path):
+    from generation import BUCKET_BATCHES
+
+    checkpoint = StageCheckpoint(str(tmp_path / "checkpoint.db"))
+    statements = [f"statement {i}" for i in range(100)]
+    chunks = []
+    run_stage(checkpoint, "qu", statements, statements, lambda chunk: chunks.append(len(chunk)) or list(chunk), 5)
+    checkpoint.close()
+
+    # Whole chunks of BUCKET_BATCHES batches reach generate(), so length bucketing has prompts to reorder.
+    assert chunks[0] == 5 * BUCKET_BATCHES and sum(chunks) == 100
+
+
+def test_record_labels_are_not_restored_under_other_settings(monkeypatch, tmp_path):
+    import main
+
+    calls = []
+    monkeypatch.setattr(main, "classify_records", lambda chunk, **kwargs: calls.append(kwargs) or ["Record"] * len(chunk))
+    checkpoint = StageCheckpoint(str(tmp_path / "checkpoint.db"))
+    statements = ["Kohli scored the most runs"]
+
+    for settings in ({}, {"few_shot_k": 8}, {"few_shot_k": 8, "few_shot_human": True}, {"pack_size": 4},
+                     {"reuse_prefix": True}, {"mode": "cascade", "thresholds": (0.2, 0.8)}, {"few_shot_k": 8}):
+        main.label_records(statements, checkpoint=checkpoint, progress=False, **settings)
+    checkpoint.close()
+
+    # Every distinct setting is labelled afresh; only the repeated few_shot_k=8 run is restored.
+    assert len(calls) == 6
@@ -0,0 +1,35 @@
+import json
+
+import classifyRecords
+import models
+
+
+class StubExampleIndex:
+    def nearest(self, statements, k):
+        return [[(f"{s} example {r}", "Record") for r in range(k)] for s in statements]
+
+
+def test_packed_prompts_carry_each_packs_nearest_examples(monkeypatch, clean_registry, tiny_loader):
+    models.register_model("classify_records", tiny_loader)
+    monkeypatch.setattr(classifyRecords, "get_example_index", lambda include_human=False: StubExampleIndex())
+    seen = []
+
+    def generate(model_id, tokenizer, model, prompts, **kwargs):
+        seen.extend(prompts)
+        return ["\n".join(f"{json.dumps(s)} -> Record" for s in json_lines(p)) for p in prompts]
+
+    def json_lines(prompt):
+        return [json.loads(line) for line in prompt.split(classifyRecords.PACK_HEADER)[1].splitlines() if line]
+
+    monkeypatch.setattr(classifyRecords, "generate", generate)
+    statements = ["a", "b", "c"]
+    labels = classifyRecords.classify_records(statements, pack_size=2, few_shot_k=3)
+
+    assert labels == ["Record"] * 3
+    assert len(seen) == 2
+    # Round robin over the pack's statements, closest example last, then only this pack's statements.
+    assert seen[0].endswith('"b example 0" -> Record\n"a example 0" -> Record\n' + classifyRecords.build_packed_suffix(["a", "b"]))
+    assert '"a example 1" -> Record\n"b example 0"' in seen[0]
+    assert '"c example 2"' in seen[1] and '"a example' not in seen[1]
+    # The fixed few-shot block is replaced, not appended to.
+    assert json.dumps(classifyRecords.examples_data[0][0]) not in seen[0]
@@ -0,0 +1,66 @@
+import pytest
+
+import sports
+
+
+def test_similarity_is_cosine_of_unnormalised_vectors(entity_processor):
+    matches = entity_processor.findEntityMatches(["virat kohli", "Virat Kohly"], "player")
+
+    assert matches["virat kohli"][0][0] == 10
+    assert matches["virat kohli"][0][1] == pytest.approx(1.0, abs=1e-5)
+    assert matches["Virat Kohly"][0][1] < 0.9
+
+
+def test_near_miss_name_is_escalated(entity_processor, monkeypatch):
+    entity_processor.accept_similarity = 0.95
+    prompts = []
+
+    def respond(batch, batch_size=None, stop=None):
+        prompts.extend(batch)
+        return ["<ID>-1</ID>"] * len(batch)
+
+    monkeypatch.setattr(entity_processor, "getLLMResponseBatch", respond)
+    metadata = entity_processor.getEntityMetadata(
+        [{"player": ["Virat Kohly"], "team": ["India"]}, {"player": ["ms dhoni"], "rivalteam": ["England"]}],
+        ["Virat Kohly scored the most runs for India", "MS Dhoni has the most stumpings against England"]
+    )
+
+    assert len(prompts) == 1 and "Virat Kohly" in prompts[0]
+    assert metadata == [{"Virat Kohly": 10, "India": 1}, {"ms dhoni": 12, "England": 2}]
+    assert entity_processor.entity_stats == {"mentions": 2, "accepted_similarity": 0, "accepted_name": 1, "llm": 1}
+
+
+def test_uncalibrated_sport_accepts_only_name_matches(entity_processor, monkeypatch):
+    monkeypatch.setattr(entity_processor, "getLLMResponseBatch", lambda batch, **kwargs: ["<ID>11</ID>"] * len(batch))
+    metadata = entity_processor.getEntityMetadata([{"player": ["Rohit"]}], ["Rohit hit the most sixes"])
+
+    assert metadata == [{"Rohit": "11"}]
+    assert entity_processor.entity_stats["llm"] == 1
+
+
+def test_calibrated_threshold_keeps_precision():
+    similarities = [0.99, 0.97, 0.95, 0.93, 0.9, 0.85, 0.8]
+    correct = [True, True, True, True, False, True, False]
+
+    assert sports.calibrate_entity_threshold(similarities, correct, precision=1.0, support=2) == 0.93
+    assert sports.calibrate_entity_threshold(similarities, correct, precision=0.8, support=2) == 0.85
+    assert sports.calibrate_entity_threshold(similarities, correct, precision=1.0, support=5) is None
+    # A threshold cannot split tied similarities.
+    assert sports.calibrate_entity_threshold([0.9, 0.9, 0.8], [True, False, True], precision=1.0, support=1) is None
+
+
+def test_similarity_gate_is_opt_in(entity_processor, tmp_path):
+    from benchmark import benchmark_entity_gate
+
+    assert entity_processor.accept_similarity is None
+    matches = tmp_path / "matches.csv"
+    matches.write_text("sport,mention,player_id\n" + "cricket,virat kohli,10\ncricket,rohit sharma,11\n" * 12)
+    thresholds = tmp_path / "entity_thresholds.json"
+
+    report = benchmark_entity_gate(str(matches), 0.99, str(thresholds))
+
+    assert report["cricket"]["accepted"] == 24
+    gated = sports.SportsProcessor("cricket", entity_thresholds=str(thresholds))
+    assert gated.accept_similarity == pytest.approx(report["cricket"]["threshold"])
+    with pytest.raises(FileNotFoundError, match="entity-gate"):
+        sports.SportsProcessor("cricket", entity_thresholds=str(tmp_path / "missing.json"))
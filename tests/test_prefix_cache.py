@@ -0,0 +1,24 @@
+import gc
+import weakref
+
+import models
+import classifyRecords
+from models import ModelResidency
+
+
+def test_evicted_model_is_collected_despite_prefix_cache(clean_registry, tiny_loader):
+    models.register_model("classify_records", tiny_loader)
+    residency = ModelResidency()
+
+    tokenizer, model = residency.activate("classify_records")
+    cache = classifyRecords.get_prefix_cache(tokenizer, model, prefix="Label each statement.\n")
+    assert classifyRecords.get_prefix_cache(tokenizer, model, prefix="Label each statement.\n") is cache
+    model_ref, kv_ref = weakref.ref(model), weakref.ref(cache.past_key_values)
+    del tokenizer, model, cache
+
+    residency.evict("classify_records")
+    gc.collect()
+
+    assert model_ref() is None
+    assert kv_ref() is None
+    assert len(classifyRecords._prefix_caches) == 0
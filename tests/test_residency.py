@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+import torch
+
+import models
+from models import ModelResidency, get_model, is_loaded, set_residency
+
+
+def test_cpu_load_evict_and_peak_accounting(clean_registry, tiny_loader):
+    models.register_model("classify_records", tiny_loader)
+    models.register_model("sports", tiny_loader)
+    residency = ModelResidency(budget_bytes=None)
+    set_residency(residency)
+
+    get_model("classify_records")
+    spike = np.ones(50_000_000)  # ~400 MB touched while the classifier is active
+    del spike
+    get_model("sports")
+    assert not is_loaded("classify_records") and is_loaded("sports")
+    get_model("classify_records")
+
+    stats = residency.report()
+    assert stats["classify_records"]["loads"] == 2 and stats["classify_records"]["evictions"] == 1
+    assert stats["sports"]["loads"] == 1 and stats["sports"]["evictions"] == 1
+    # The peak is rewound on every activation, so the spike only shows up against the stage it happened in.
+    assert stats["classify_records"]["peak_bytes"] - stats["sports"]["peak_bytes"] > 300 * 2**20
+
+
+@pytest.mark.skipif(torch.cuda.is_available(), reason="the budget defaults to device memory on CUDA")
+def test_streaming_residency_without_budget_is_rejected(clean_registry, tmp_path):
+    import main
+
+    with pytest.raises(ValueError, match="memory_budget"):
+        main.run_pipeline(["Virat Kohli scored 183"], output_path=str(tmp_path / "out.jsonl"), stream=True, manage_residency=True)
+
+
+def test_memory_monitor_and_residency_share_peaks(clean_registry, tiny_loader):
+    from memory import MemoryMonitor
+
+    models.register_model("sports", tiny_loader)
+    residency = ModelResidency(budget_bytes=None)
+    set_residency(residency)
+    monitor = MemoryMonitor()
+    try:
+        get_model("sports")
+        spike = np.ones(100_000_000)  # ~800 MB, before any monitor span opens
+        del spike
+        baseline = models.memory_in_use()
+        with monitor.measure("sql_pipeline", "stage", {"sport": "cricket"}):
+            with monitor.measure("generate", "generate", {"model": "sports"}):
+                spike = np.ones(25_000_000)  # ~200 MB, inside both spans
+                del spike
+    finally:
+        monitor.close()
+
+    # The monitor's spans must not wipe the earlier spike from the residency's stage peak, nor the residency
+    # window the spike from the spans.
+    stage_peak = residency.report()["sports"]["peak_bytes"]
+    assert stage_peak - baseline > 700 * 2**20
+    for key in ("cricket:sql_pipeline", "generate:sports"):
+        assert 150 * 2**20 < monitor.stats[key]["peak_rss"] - baseline < 400 * 2**20
@@ -0,0 +1,32 @@
+import torch
+
+import models
+import sports
+from models import ModelResidency, is_loaded, set_residency
+
+
+def test_speculative_output_matches_greedy(monkeypatch, clean_registry, tiny_loader, entity_processor):
+    def load_draft():
+        # A perturbed copy, so the target accepts some of the draft's proposals and rejects others.
+        tokenizer, model = tiny_loader()
+        torch.manual_seed(1)
+        with torch.no_grad():
+            for p in model.parameters():
+                p.add_(torch.randn_like(p) * 0.01)
+        return tokenizer, model
+
+    models.register_model("sports", tiny_loader)
+    models.register_model("sports_draft", load_draft, companion_of="sports")
+    monkeypatch.setattr(sports, "MAX_NEW_TOKENS", 24)
+    residency = ModelResidency(budget_bytes=None)
+    set_residency(residency)
+
+    prompts = ["Virat Kohli scored the most runs", "Most runs in an ODI innings against England"]
+    greedy = entity_processor.getLLMResponseBatch(prompts, batch_size=2, stop="qu")
+    entity_processor.speculative = True
+    speculative = entity_processor.getLLMResponseBatch(prompts, batch_size=2, stop="qu")
+
+    assert speculative == greedy
+    # The draft is loaded through the registry and kept resident alongside the SQL model.
+    assert is_loaded("sports") and is_loaded("sports_draft")
+    assert residency.stats["sports"]["loads"] == 1 and residency.stats["sports_draft"]["loads"] == 1
@@ -0,0 +1,59 @@
+import pytest
+
+from sql_template import fill_template, placeholder_values, TemplateBindingError
+
+
+@pytest.mark.parametrize("template, values, expected", [
+    ("SELECT * FROM t WHERE team_id = ##teamid## AND opponent_team_id = ##rivalteamid##", {"teamid": "102"},
+     "SELECT * FROM t WHERE team_id = 102"),
+    ("SELECT * FROM t WHERE player_id = ##playerid##;", {}, "SELECT * FROM t;"),
+    ("SELECT a FROM t\nWHERE opponent_team_id = ##rivalteamid##\nORDER BY a DESC\nLIMIT 5;", {},
+     "SELECT a FROM t\nORDER BY a DESC\nLIMIT 5;"),
+    ("SELECT a FROM t WHERE x BETWEEN 1 AND 5 AND venue_id = ##venueid## AND y > 0", {},
+     "SELECT a FROM t WHERE x BETWEEN 1 AND 5 AND y > 0"),
+    ("SELECT a, COUNT(*) c FROM t GROUP BY a HAVING c >= 50 AND SUM(team_id = ##teamid##) > 0 ORDER BY c", {},
+     "SELECT a, COUNT(*) c FROM t GROUP BY a HAVING c >= 50 ORDER BY c"),
+    ("SELECT a FROM t WHERE a IN (SELECT a FROM u WHERE player_id = ##playerid##) AND y > 0", {},
+     "SELECT a FROM t WHERE a IN (SELECT a FROM u) AND y > 0"),
+    ("SELECT ##playerid## AS p FROM t", {}, "SELECT NULL AS p FROM t"),
+    ("SELECT a FROM t WHERE Player_ID = ##PLAYERID##", {"playerid": "9"}, "SELECT a FROM t WHERE Player_ID = 9"),
+])
+def test_fill_template(template, values, expected):
+    assert fill_template(template, values) == expected
+
+
+@pytest.mark.parametrize("template, values, expected", [
+    # Top-level OR: the unbound branch goes, the rest of the filter stays.
+    ("SELECT * FROM t WHERE season = 2020 OR player_id = ##playerid##", {},
+     "SELECT * FROM t WHERE season = 2020"),
+    ("SELECT * FROM t WHERE (season = 2020 OR player_id = ##playerid##)", {},
+     "SELECT * FROM t WHERE (season = 2020)"),
+    ("SELECT * FROM t WHERE player_id = ##playerid## OR team_id = ##teamid##", {}, "SELECT * FROM t"),
+    ("SELECT * FROM t WHERE season = 2020 OR player_id = ##playerid##", {"playerid": "4"},
+     "SELECT * FROM t WHERE season = 2020 OR player_id = 4"),
+    # AND binds tighter than OR: (a AND p) OR c.
+    ("SELECT * FROM t WHERE a = 1 AND player_id = ##playerid## OR c = 2", {},
+     "SELECT * FROM t WHERE a = 1 OR c = 2"),
+    ("SELECT * FROM t WHERE a = 1 OR player_id = ##playerid## AND c = 2", {},
+     "SELECT * FROM t WHERE a = 1 OR c = 2"),
+    ("SELECT * FROM t WHERE player_id = ##playerid## AND a = 1 OR team_id = ##teamid##", {"teamid": "3"},
+     "SELECT * FROM t WHERE a = 1 OR team_id = 3"),
+    ("SELECT * FROM t WHERE (a = 1 OR team_id = ##teamid##) AND player_id = ##playerid##", {},
+     "SELECT * FROM t WHERE (a = 1)"),
+])
+def test_or_branches(template, values, expected):
+    assert fill_template(template, values) == expected
+
+
+def test_join_condition_is_kept_or_binding_fails():
+    template = "SELECT * FROM a JOIN b ON a.id = b.id AND b.team_id = ##teamid## WHERE a.x > 0"
+    assert fill_template(template, {}) == "SELECT * FROM a JOIN b ON a.id = b.id WHERE a.x > 0"
+
+    with pytest.raises(TemplateBindingError):
+        fill_template("SELECT * FROM a JOIN b ON b.team_id = ##teamid## WHERE a.x > 0", {})
+
+
+def test_placeholder_values():
+    finalqu = {"player": ["A", "B"], "team": [], "rivalteam": ["England"]}
+    metadata = {"A": None, "B": 45, "England": "x7", "venue": 3}
+    assert placeholder_values(finalqu, metadata) == {"playerid": "45", "venueid": "3"}
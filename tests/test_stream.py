@@ -0,0 +1,42 @@
+from types import SimpleNamespace
+
+import main
+
+
+def test_stream_reuses_results_across_batches(monkeypatch):
+    labelled, processed = [], []
+
+    def label_statements(statements, *args, **kwargs):
+        labelled.extend(statements)
+        return [{"statement": s, "sport": "cricket"} for s in statements if "record" in s.lower()]
+
+    def process_sport(processor, sport, statements, **kwargs):
+        processed.extend(statements)
+        return [{"statement": s, "sport": sport, "sql": f"-- {s}"} for s in statements]
+
+    monkeypatch.setattr(main, "label_statements", label_statements)
+    monkeypatch.setattr(main, "process_sport", process_sport)
+    monkeypatch.setattr(main, "make_processor", lambda sport, **kwargs: SimpleNamespace(profiler=SimpleNamespace(enabled=False)))
+
+    batches = [["Kohli record", "Just a match report"], ["kohli  RECORD.", "just a match report", "Root record"]]
+    results = list(main.stream_results(batches))
+
+    assert labelled == ["Kohli record", "Just a match report", "Root record"]
+    assert processed == ["Kohli record", "Root record"]
+    assert [(r["statement"], r["sql"]) for r in results] == [
+        ("Kohli record", "-- Kohli record"), ("kohli  RECORD.", "-- Kohli record"), ("Root record", "-- Root record")
+    ]
+
+
+def test_stream_dedupe_is_bounded(monkeypatch):
+    processed = []
+    monkeypatch.setattr(main, "label_statements", lambda statements, *a, **k: [{"statement": s, "sport": "cricket"} for s in statements])
+    monkeypatch.setattr(main, "process_sport", lambda processor, sport, statements, **k: processed.extend(statements) or
+                        [{"statement": s, "sport": sport} for s in statements])
+    monkeypatch.setattr(main, "make_processor", lambda sport, **kwargs: SimpleNamespace(profiler=SimpleNamespace(enabled=False)))
+
+    results = list(main.stream_results([["a record"], ["b record"], ["c record"], ["b record"], ["a record"]], dedupe_entries=2))
+
+    # "b" is still among the two most recent; "a" was evicted by "c" and is recomputed.
+    assert processed == ["a record", "b record", "c record", "a record"]
+    assert len(results) == 5
@@ -0,0 +1,33 @@
+import json
+
+import main
+from checkpoint import StageCheckpoint
+from tracing import TraceRecorder, set_tracer
+
+
+def test_spans_are_tagged_with_input_rows(monkeypatch, tmp_path, entity_processor):
+    players = {"Kohli": "Virat Kohli", "Rohit": "Rohit Sharma", "Dhoni": "M.S. Dhoni"}
+    processor = entity_processor
+    processor.getQU_batch = lambda chunk, batch_size: [{"player": [players[s.split()[0].title()]]} for s in chunk]
+    processor.getTemplateSQL_batch = lambda fqs, statements, batch_size: ["SELECT 1;" for _ in fqs]
+    processor.getFullSQL_batch = lambda fqs, templates, metadata, batch_size: list(templates)
+    processor.config = dict(processor.config, db=dict(processor.config["db"], execute_query=lambda sql: (["x"], [[1]])))
+    monkeypatch.setattr(main, "label_statements", lambda statements, *a, **k: [{"statement": s, "sport": "cricket"} for s in statements])
+    monkeypatch.setattr(main, "make_processor", lambda sport, **kwargs: processor)
+    # Two-statement chunks, so chunk-relative positions would differ from the input rows.
+    monkeypatch.setattr(main, "sql_batch_size", lambda residency: 2)
+
+    tracer = TraceRecorder(str(tmp_path / "trace.json"))
+    set_tracer(tracer)
+    checkpoint = StageCheckpoint(str(tmp_path / "checkpoint.db"))
+    try:
+        statements = ["Kohli record", "Rohit record", "Dhoni record", "kohli RECORD", "Rohit record"]
+        main._run_pipeline(statements, str(tmp_path / "out.json"), checkpoint, "records")
+    finally:
+        set_tracer(None)
+        checkpoint.close()
+
+    for name in ("getStatFromDB", "execute_query"):
+        tags = sorted((e["args"]["statement"], e["args"]["rows"]) for e in tracer.events if e["name"] == name)
+        assert tags == [(0, [0, 3]), (1, [1, 4]), (2, [2])]
+    assert len(json.load(open(tmp_path / "out.json"))) == 5
@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext, ExitStack
+
+
+_tracer = None
+_span_hooks = []
+
+
+class TraceRecorder:
+    """Collects complete ("X") trace events and writes them as Chrome/Perfetto trace-event JSON.
+
+    Args given to `tags` are attached to every span opened inside it, so nested spans inherit the
+    sport or statement index of their caller.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.events = []
+        self.start = time.perf_counter()
+        self._tags = threading.local()
+
+    def _current_tags(self):
+        return getattr(self._tags, "stack", [{}])[-1]
+
+    @contextmanager
+    def tags(self, **args):
+        stack = getattr(self._tags, "stack", [{}])
+        self._tags.stack = stack + [dict(stack[-1], **args)]
+        try:
+            yield
+        finally:
+            self._tags.stack = stack
+
+    @contextmanager
+    def span(self, name, cat="pipeline", **args):
+        args = dict(self._current_tags(), **args)
+        begin = time.perf_counter()
+        try:
+            with self.tags(**args):
+                yield
+        finally:
+            end = time.perf_counter()
+            self.events.append({
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": (begin - self.start) * 1e6,
+                "dur": (end - begin) * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": args,
+            })
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f, default=str)
+        print(f"Trace with {len(self.events)} spans saved to {self.path}")
+
+
+def set_tracer(tracer):
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+def add_span_hook(hook):
+    """Also enter `hook(name, cat, args)`, a context manager, around every span (e.g. MemoryMonitor.measure)."""
+    _span_hooks.append(hook)
+
+
+def remove_span_hook(hook):
+    if hook in _span_hooks:
+        _span_hooks.remove(hook)
+
+
+@contextmanager
+def _hooked_span(name, cat, args):
+    with ExitStack() as stack:
+        if _tracer is not None:
+            stack.enter_context(_tracer.span(name, cat, **args))
+        for hook in list(_span_hooks):
+            stack.enter_context(hook(name, cat, args))
+        yield
+
+
+def trace_span(name, cat="pipeline", **args):
+    """A span on the active tracer and span hooks, or a no-op when neither is set."""
+    if _tracer is None and not _span_hooks:
+        return nullcontext()
+    return _hooked_span(name, cat, args)
+
+
+def trace_tags(**args):
+    return _tracer.tags(**args) if _tracer is not None else nullcontext()
@@ -1,6 +1,14 @@
 import os
+import json
+import unicodedata
 import pandas as pd
 
+
+QUOTE_TRANSLATION = str.maketrans({
+    "\u2018": "'", "\u2019": "'", "\u201a": "'", "\u201b": "'", "\u2032": "'", "`": "'",
+    "\u201c": '"', "\u201d": '"', "\u201e": '"', "\u201f": '"', "\u2033": '"',
+})
+
 def load_statements(input_data):
     
     if isinstance(input_data, list):
@@ -13,4 +21,103 @@ def load_statements(input_data):
         return statements
     
     else:
-        raise ValueError("Input must be a list of strings or a valid CSV file path.")
\ No newline at end of file
+        raise ValueError("Input must be a list of strings or a valid CSV file path.")
+
+
+def iter_statements(input_data, chunksize=1000):
+    """Yield statements one at a time; CSV files are read in chunks of `chunksize` rows."""
+
+    if isinstance(input_data, str):
+        if not os.path.isfile(input_data):
+            raise ValueError("Input must be an iterable of strings or a valid CSV file path.")
+        for chunk in pd.read_csv(input_data, chunksize=chunksize):
+            for s in chunk[chunk.columns[0]].dropna().astype(str):
+                yield s
+    else:
+        for s in input_data:
+            if pd.notna(s):
+                yield str(s)
+
+
+def batched(iterable, n):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def append_jsonl(path, records):
+    with open(path, 'a') as f:
+        for r in records:
+            f.write(json.dumps(r, default=str) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _labelled_rows(df):
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    statement_col = "statements" if "statements" in df.columns else df.columns[0]
+    sport_col = "sport" if "sport" in df.columns else df.columns[1]
+    df = df[[statement_col, sport_col]].dropna()
+    for stmt, sport in zip(df[statement_col].astype(str), df[sport_col].astype(str)):
+        yield {"statement": stmt.strip(), "sport": sport.strip().lower()}
+
+
+def iter_labelled_statements(input_data, chunksize=1000):
+    """Yield {"statement", "sport"} dicts from a sport-labelled CSV or an iterable of pairs/dicts."""
+
+    if isinstance(input_data, str):
+        if not os.path.isfile(input_data):
+            raise ValueError("Input must be an iterable of (statement, sport) pairs or a valid CSV file path.")
+        for chunk in pd.read_csv(input_data, chunksize=chunksize):
+            yield from _labelled_rows(chunk)
+    else:
+        for item in input_data:
+            stmt, sport = (item["statement"], item["sport"]) if isinstance(item, dict) else item
+            if pd.notna(stmt) and pd.notna(sport):
+                yield {"statement": str(stmt).strip(), "sport": str(sport).strip().lower()}
+
+
+def load_labelled_statements(input_data):
+    return list(iter_labelled_statements(input_data))
+
+
+def load_record_labels(path):
+    """(statements, labels) from a record-labelled CSV, with labels normalised to "Record"/"Non-Record"."""
+    df = pd.read_csv(path).dropna()
+    statements = df[df.columns[0]].astype(str).str.strip().tolist()
+    labels = ["Record" if str(l).strip().lower() == "record" else "Non-Record" for l in df[df.columns[1]]]
+    return statements, labels
+
+
+def canonicalize_statement(statement):
+    """Normalise unicode, quote style and whitespace, and drop wrapping quotes and trailing punctuation."""
+    s = unicodedata.normalize("NFKC", statement).translate(QUOTE_TRANSLATION)
+    s = " ".join(s.split())
+    s = s.strip("\"' ")
+    return s.rstrip(".!;:, ").strip()
+
+
+def statement_key(statement):
+    return canonicalize_statement(statement).casefold()
+
+
+def dedupe_statements(items):
+    """Collapse statements (or {"statement", ...} dicts) that share a canonical key.
+
+    Returns the first occurrence of every key, in input order, and for each input row the position
+    of the unique item that stands for it.
+    """
+
+    unique, positions, seen = [], [], {}
+    for item in items:
+        key = statement_key(item["statement"] if isinstance(item, dict) else item)
+        if key not in seen:
+            seen[key] = len(unique)
+            unique.append(item)
+        positions.append(seen[key])
+    return unique, positions
@@ -3,7 +3,8 @@ import csv
 import sqlite3
 import faiss
 import numpy as np
-from langchain_huggingface import HuggingFaceEmbeddings
+
+from models import get_embedding_function
 
 
 os.makedirs('db', exist_ok=True)
@@ -240,9 +241,7 @@ def create_vector_store(sport, sport_config):
     
     team_ids, team_names, player_ids, player_names = load_entity_data(sport_config)
     
-    embedding_function = HuggingFaceEmbeddings(
-        model_name='/scratch/nitishk_iitp/models/paraphrase-MiniLM-L6-v2'
-    )
+    embedding_function = get_embedding_function()
     
     if team_names:
         teams_embedding = embedding_function.embed_documents(team_names)